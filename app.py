@@ -3,16 +3,37 @@ import streamlit as st
 import yfinance as yf
 import pandas as pd
 import requests
-import matplotlib.pyplot as plt
 from datetime import datetime, timedelta
 import time
 import logging
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
+from streaming import STREAM_MODE, price_stream
+from backtest import (
+    BacktestError, FREQUENCIES, load_price_history, lots_from_portfolio,
+    run_backtest, run_sweep
+)
+from optimizer import OptimizationError, optimize_portfolio, generate_trades
+from corporate_actions import sync_corporate_actions
+from snapshots import (
+    REPLAY_MODE, UpstreamUnavailableError, breaker_for, describe_staleness, in_resilient_call, resilient_call
+)
+from singleflight import single_flight
+from charts import (
+    render_sparkline, render_price_chart, render_allocation_chart,
+    render_equity_curve, portfolio_equity_curve
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# --- Upstream Settings ---
+YAHOO_HOST = "finance.yahoo.com"
+NEWS_HOST = "news.google.com"
+QUOTE_DEADLINE = 4.0
+LOGO_DEADLINE = 2.0
+NEWS_DEADLINE = 4.0
+
 # --- Enhanced Page Config ---
 st.set_page_config(
     page_title="AI Portfolio Tracker", 
@@ -252,10 +273,15 @@ def initialize_session_state():
         "watchlist": [],
         "total_portfolio_value": 0.0,
         "daily_change": 0.0,
+        "live_cursors": {},  # {key: (bus version seen, live holding data)}
+        "live_since": 0,  # bus version when the current quotes were fetched
         "user_preferences": {
             "currency": "₹",
             "theme": "dark",
-            "notifications": True
+            "notifications": True,
+            "live_prices": False,
+            "live_refresh": 5,
+            "replay_mode": REPLAY_MODE
         }
     }
     
@@ -266,30 +292,51 @@ def initialize_session_state():
 # --- Enhanced Helper Functions with Error Handling ---
 def safe_request(url: str, headers: dict = None, timeout: int = 10) -> Optional[requests.Response]:
     """Make a safe HTTP request with error handling"""
+    # Under resilient_call the outer call owns the host's breaker; checking it here as
+    # well would take its half-open trial slot and count every failure twice
+    breaker = None if in_resilient_call() else breaker_for(url)
+    if breaker and not breaker.allow():
+        logger.warning(f"Skipping request to {url}: circuit open")
+        return None
+    
     try:
         headers = headers or {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"}
         response = requests.get(url, headers=headers, timeout=timeout)
         response.raise_for_status()
+        if breaker:
+            breaker.record_success()
         return response
+    except requests.HTTPError as e:
+        # A 4xx means the host is up; only server errors count against it
+        if breaker and e.response is not None and e.response.status_code < 500:
+            breaker.record_success()
+        elif breaker:
+            breaker.record_failure()
+        logger.error(f"Request failed for {url}: {str(e)}")
+        return None
     except requests.RequestException as e:
+        if breaker:
+            breaker.record_failure()
         logger.error(f"Request failed for {url}: {str(e)}")
         return None
 
-def search_ticker(company_name: str) -> Optional[str]:
+def search_ticker(company_name: str, replay: bool = False) -> Optional[str]:
     """Search for ticker symbol with enhanced error handling"""
     if not company_name or len(company_name.strip()) < 2:
         raise ValidationError("Company name must be at least 2 characters long")
     
-    try:
+    def lookup() -> Optional[str]:
         # Try multiple search methods
         search_methods = [
             f"https://query2.finance.yahoo.com/v1/finance/search?q={company_name}",
             f"https://query1.finance.yahoo.com/v7/finance/search?q={company_name}"
         ]
+        responded = False
         
         for url in search_methods:
             response = safe_request(url)
             if response:
+                responded = True
                 result = response.json()
                 quotes = result.get("quotes", [])
                 
@@ -297,12 +344,23 @@ def search_ticker(company_name: str) -> Optional[str]:
                     if quote.get("quoteType") == "EQUITY" and quote.get("symbol"):
                         return quote.get("symbol")
         
-        raise StockNotFoundError(f"No ticker found for '{company_name}'")
+        if not responded:
+            # Lets the search fall back to a recorded result
+            raise DataFetchError(f"No ticker search endpoint responded for '{company_name}'")
+        return None
+    
+    try:
+        # "Not found" answers are recorded too, so replay gives the same answer
+        symbol, _ = resilient_call("search", company_name.strip().upper(), YAHOO_HOST, lookup, QUOTE_DEADLINE, replay)
+        if symbol is None:
+            raise StockNotFoundError(f"No ticker found for '{company_name}'")
+        return symbol
         
     except Exception as e:
         logger.error(f"Ticker search failed: {str(e)}")
         raise DataFetchError(f"Failed to search for ticker: {str(e)}")
 
+@single_flight.shared("quote")
 def get_stock_data(ticker: str) -> Dict:
     """Fetch stock data with comprehensive error handling"""
     try:
@@ -342,6 +400,24 @@ def get_stock_data(ticker: str) -> Dict:
         logger.error(f"Failed to fetch data for {ticker}: {str(e)}")
         raise DataFetchError(f"Unable to fetch data for {ticker}: {str(e)}")
 
+@st.cache_data(ttl=900, show_spinner=False)
+def get_price_history(ticker: str, period: str = "1y", replay: bool = False) -> pd.Series:
+    """Fetch daily closing prices for charts, falling back to the last snapshot"""
+    def fetch() -> Dict:
+        hist = yf.Ticker(ticker).history(period=period)
+        if hist.empty:
+            raise DataFetchError(f"No price history available for {ticker}")
+        closes = hist["Close"].dropna()
+        return {"dates": [ts.isoformat() for ts in closes.index], "closes": closes.tolist()}
+    
+    try:
+        history, _ = resilient_call("history", f"{ticker}:{period}", YAHOO_HOST, fetch, QUOTE_DEADLINE, replay)
+        return pd.Series(history["closes"], index=pd.to_datetime(history["dates"], utc=True), name="Close")
+    except Exception as e:
+        logger.error(f"Failed to fetch history for {ticker}: {str(e)}")
+        raise DataFetchError(f"Unable to fetch history for {ticker}: {str(e)}")
+
+@single_flight.shared("logo")
 def get_enhanced_logo_url(company_name: str) -> str:
     """Get company logo with fallback options"""
     fallback_urls = [
@@ -360,6 +436,7 @@ def get_enhanced_logo_url(company_name: str) -> str:
     
     return fallback_urls[-1]  # Return placeholder
 
+@single_flight.shared("news")
 def fetch_enhanced_news(company_name: str) -> List[Dict]:
     """Fetch news with multiple sources and error handling"""
     news_sources = [
@@ -368,6 +445,7 @@ def fetch_enhanced_news(company_name: str) -> List[Dict]:
     ]
     
     all_news = []
+    responded = False
     
     for source in news_sources:
         try:
@@ -377,6 +455,7 @@ def fetch_enhanced_news(company_name: str) -> List[Dict]:
                 
             response = safe_request(source)
             if response:
+                responded = True
                 # Parse RSS feed
                 from xml.etree import ElementTree as ET
                 root = ET.fromstring(response.content)
@@ -409,6 +488,10 @@ def fetch_enhanced_news(company_name: str) -> List[Dict]:
             logger.error(f"Failed to fetch news from {source}: {str(e)}")
             continue
     
+    if not responded:
+        # Lets callers fall back to recorded news instead of showing an empty list
+        raise DataFetchError(f"No news source responded for {company_name}")
+    
     return all_news[:6]  # Return top 6 articles
 
 def show_error_message(message: str, error_type: str = "error"):
@@ -438,6 +521,166 @@ def show_loading_spinner():
     """Display loading animation"""
     st.markdown('<div class="loading-spinner"></div>', unsafe_allow_html=True)
 
+# --- Portfolio Rendering ---
+def build_holding_data(data: Dict, holding: Dict) -> Dict:
+    """Combine market data with a holding's lots into tile figures"""
+    quantity = holding["quantity"]
+    avg_purchase_price = holding["total_cost"] / quantity if quantity > 0 else 0
+    current_value = data["price"] * quantity
+    invested_amount = holding["total_cost"]
+    dividend_income = holding.get("dividend_income", 0.0)
+    profit_loss = current_value - invested_amount + dividend_income
+    
+    return {
+        **data, 
+        "quantity": quantity,
+        "avg_purchase_price": avg_purchase_price,
+        "invested_amount": invested_amount,
+        "current_value": current_value,
+        "dividend_income": dividend_income,
+        "profit_loss": profit_loss,
+        "profit_loss_pct": (profit_loss / invested_amount) * 100 if invested_amount > 0 else 0,
+        "purchases": holding["purchases"]
+    }
+
+def reprice_holding(data: Dict, price: float) -> Dict:
+    """Recompute a holding's figures at a new price"""
+    if price == data["price"]:
+        return data
+    
+    prev_price = data["price"] - data["change"]
+    change = price - prev_price
+    current_value = price * data["quantity"]
+    invested_amount = data["invested_amount"]
+    profit_loss = current_value - invested_amount + data["dividend_income"]
+    return {
+        **data,
+        "price": price,
+        "change": change,
+        "change_pct": (change / prev_price) * 100 if prev_price != 0 else 0,
+        "current_value": current_value,
+        "profit_loss": profit_loss,
+        "profit_loss_pct": (profit_loss / invested_amount) * 100 if invested_amount > 0 else 0
+    }
+
+def with_live_prices(portfolio_data: Dict[str, Dict], bus, cursor_key: str) -> Dict[str, Dict]:
+    """Re-price holdings from ticks that arrived since this view last looked at the bus
+    
+    Each live view keeps its own cursor (bus version plus the figures it
+    last showed) in session state, so holdings whose price has not moved
+    are returned as-is instead of being recomputed.
+    """
+    bus.watch(portfolio_data.keys())
+    cursors = st.session_state.live_cursors
+    # Ticks already on the bus before the quotes were fetched are older than them
+    version, live_data = cursors.get(cursor_key, (st.session_state.live_since, portfolio_data))
+    version, changed = bus.changes_since(version, portfolio_data.keys())
+    if changed:
+        live_data = {
+            **live_data,
+            **{ticker: reprice_holding(portfolio_data[ticker], tick["price"]) for ticker, tick in changed.items()}
+        }
+    cursors[cursor_key] = (version, live_data)
+    return live_data
+
+def render_portfolio_metrics(portfolio_data: Dict[str, Dict], currency: str):
+    """Display the portfolio total cards"""
+    total_value = sum(data["current_value"] for data in portfolio_data.values())
+    total_invested = sum(data["invested_amount"] for data in portfolio_data.values())
+    total_income = sum(data["dividend_income"] for data in portfolio_data.values())
+    total_change = total_value - total_invested + total_income
+    total_change_pct = (total_change / total_invested) * 100 if total_invested > 0 else 0
+    
+    col1, col2, col3, col4 = st.columns(4)
+
+    with col1:
+        st.markdown("""
+        <div class="metric-card">
+            <h3>💰 Total Value</h3>
+            <h2>{}{:,.2f}</h2>
+        </div>
+        """.format(currency, total_value), unsafe_allow_html=True)
+
+    with col2:
+        change_color = "#46D369" if total_change >= 0 else "#E50914"
+        st.markdown(f"""
+        <div class="metric-card">
+            <h3>📈 Total P&L</h3>
+            <h2 style="color: {change_color};">{currency}{total_change:+.2f}</h2>
+            <small style="color: #999;">incl. {currency}{total_income:,.2f} dividends</small>
+        </div>
+        """, unsafe_allow_html=True)
+
+    with col3:
+        st.markdown(f"""
+        <div class="metric-card">
+            <h3>💰 Invested</h3>
+            <h2>{currency}{total_invested:,.2f}</h2>
+        </div>
+        """, unsafe_allow_html=True)
+
+    with col4:
+        change_color = "#46D369" if total_change_pct >= 0 else "#E50914"
+        st.markdown(f"""
+        <div class="metric-card">
+            <h3>📋 Return %</h3>
+            <h2 style="color: {change_color};">{total_change_pct:+.2f}%</h2>
+        </div>
+        """, unsafe_allow_html=True)
+
+    st.markdown("<br>", unsafe_allow_html=True)
+
+def render_tile_quote(data: Dict, currency: str):
+    """Price-dependent lines of a holding tile (the part live mode refreshes)"""
+    change_color = "#46D369" if data["profit_loss"] >= 0 else "#E50914"
+    st.markdown(f"""
+    <div class="movie-tile">
+        <p><strong>Current Price:</strong> {currency}{data['price']:.2f}</p>
+        <p><strong>Current Value:</strong> {currency}{data['current_value']:,.2f}</p>
+        <p style="color: {change_color};"><strong>P&L:</strong> {currency}{data['profit_loss']:+.2f} ({data['profit_loss_pct']:+.2f}%)</p>
+    </div>
+    """, unsafe_allow_html=True)
+
+def render_portfolio_tiles(portfolio_data: Dict[str, Dict], histories: Dict[str, pd.Series], currency: str,
+                           render_quote: Optional[Callable[[str], None]] = None):
+    """Display one tile per holding
+    
+    ``render_quote(ticker)`` draws the price lines; live mode passes a
+    fragment so only that part of each tile reruns on the timer.
+    """
+    render_quote = render_quote or (lambda ticker: render_tile_quote(portfolio_data[ticker], currency))
+    cols = st.columns(3)
+    for i, (ticker, data) in enumerate(portfolio_data.items()):
+        with cols[i % 3]:
+            try:
+                logo_url = data["logo_url"]
+                stale_marker = f'<p style="color: #FFA500;">⏳ Stale {data["stale"]}</p>' if data.get("stale") else ""
+
+                if st.button(f"📺 {data['name']}", key=f"select_{ticker}", use_container_width=True):
+                    st.session_state.selected_stock = (data["name"], ticker)
+                    st.rerun()
+
+                st.markdown(f"""
+                <div class="movie-tile">
+                    <img src="{logo_url}" width="60" style="border-radius: 15px; margin-bottom: 15px;" onerror="this.src='https://via.placeholder.com/60x60/E50914/FFFFFF?text=📈'"/>
+                    <h4 style="margin: 10px 0;">{data['name']}</h4>
+                    <p><strong>Avg. Buy Price:</strong> {currency}{data['avg_purchase_price']:.2f}</p>
+                    <p><strong>Shares:</strong> {data['quantity']:g}</p>
+                    <p><strong>Invested:</strong> {currency}{data['invested_amount']:,.2f}</p>
+                    <p><strong>Dividends:</strong> {currency}{data['dividend_income']:,.2f}</p>
+                    <p><strong>Sector:</strong> {data['sector']}</p>
+                    {stale_marker}
+                </div>
+                """, unsafe_allow_html=True)
+
+                render_quote(ticker)
+
+                if ticker in histories:
+                    st.image(render_sparkline(ticker, histories[ticker]), use_container_width=True)
+
+            except Exception as e:
+                show_error_message(f"Error displaying {ticker}: {str(e)}", "warning")
+
 # --- Initialize Session State ---
 initialize_session_state()
 
@@ -472,6 +715,18 @@ with st.sidebar:
     notifications = st.checkbox("Enable Notifications", value=True)
     st.session_state.user_preferences["notifications"] = notifications
     
+    live_prices = st.toggle("📡 Live Prices", value=st.session_state.user_preferences["live_prices"],
+                            help="Stream price updates into your tiles without reloading the page")
+    st.session_state.user_preferences["live_prices"] = live_prices
+    
+    live_refresh = st.slider("Live refresh (seconds)", min_value=1, max_value=60,
+                             value=st.session_state.user_preferences["live_refresh"], disabled=not live_prices)
+    st.session_state.user_preferences["live_refresh"] = live_refresh
+    
+    replay_mode = st.toggle("🗄️ Offline Replay", value=st.session_state.user_preferences["replay_mode"],
+                            help="Serve quotes, charts and news only from recorded snapshots")
+    st.session_state.user_preferences["replay_mode"] = replay_mode
+    
     st.markdown("---")
     
     # Portfolio Summary
@@ -484,6 +739,16 @@ with st.sidebar:
         
         st.metric("Total Value", f"{currency}{total_value:,.2f}")
         st.metric("Holdings", f"{len(st.session_state.portfolio)} stocks")
+    
+    # Upstream calls shared between concurrent sessions
+    fetch_stats = single_flight.stats()
+    if fetch_stats:
+        with st.expander("🔁 Shared Fetches"):
+            for endpoint, counts in fetch_stats.items():
+                st.caption(
+                    f"**{endpoint}**: {counts['executed']} fetched, {counts['collapsed']} shared "
+                    f"of {counts['calls']} calls · {counts['timeouts']} timeouts · {counts['errors']} errors"
+                )
 
 # --- Main Content ---
 st.markdown(f"## 👋 Welcome back, **{investor_name}**")
@@ -549,7 +814,7 @@ with col2:
     add_button = st.button(
         "🎬 ADD TO PORTFOLIO", 
         use_container_width=True,
-        help="Click to add this stock to your portfolio"
+        help="Uses recorded search results and quotes in Offline Replay" if replay_mode else "Click to add this stock to your portfolio"
     )
     
     st.markdown("<br>", unsafe_allow_html=True)
@@ -571,10 +836,11 @@ with col2:
 if add_button and company_input:
     try:
         with st.spinner("🔍 Searching for stock..."):
-            ticker = search_ticker(company_input)
+            ticker = search_ticker(company_input, replay=replay_mode)
             
         with st.spinner("📈 Fetching stock data..."):
-            stock_data = get_stock_data(ticker)
+            stock_data, _ = resilient_call("quote", ticker, YAHOO_HOST, lambda: get_stock_data(ticker),
+                                           QUOTE_DEADLINE, replay_mode)
             
         # Add to portfolio with purchase details
         if ticker not in st.session_state.portfolio:
@@ -613,7 +879,7 @@ if add_button and company_input:
         show_error_message(str(e))
     except StockNotFoundError as e:
         show_error_message(f"Stock not found: {str(e)}")
-    except DataFetchError as e:
+    except (DataFetchError, UpstreamUnavailableError) as e:
         show_error_message(f"Data fetch failed: {str(e)}")
     except Exception as e:
         show_error_message(f"Unexpected error: {str(e)}")
@@ -635,114 +901,110 @@ if st.session_state.portfolio:
                     st.rerun()
 
 # --- Enhanced Portfolio Display ---
+portfolio_data = {}
 if st.session_state.portfolio:
     st.markdown("## 🎞️ Your Portfolio Collection")
     
-    # Portfolio metrics
-    col1, col2, col3, col4 = st.columns(4)
-    
     try:
         portfolio_data = {}
-        total_value = 0
-        total_invested = 0
-        total_change = 0
+        # Offline Replay streams recorded ticks instead of polling upstream
+        live_bus = price_stream.ensure("replay" if replay_mode else STREAM_MODE) if live_prices else None
+        quotes_since = live_bus.version if live_bus else 0
+        
+        # Splits and dividends since each lot was last processed
+        try:
+            adjusted = {} if replay_mode else sync_corporate_actions(st.session_state.portfolio, deadline=QUOTE_DEADLINE)
+            if adjusted:
+                show_success_message("Applied splits/dividends to " + ", ".join(
+                    f"{ticker} ({count})" for ticker, count in adjusted.items()
+                ))
+        except Exception as e:
+            logger.error(f"Corporate action processing failed: {e}")
         
+        unavailable = []
         for ticker, holding in st.session_state.portfolio.items():
             try:
-                data = get_stock_data(ticker)
-                quantity = holding["quantity"]
-                avg_purchase_price = holding["total_cost"] / quantity if quantity > 0 else 0
-                current_value = data["price"] * quantity
-                invested_amount = holding["total_cost"]
-                
-                portfolio_data[ticker] = {
-                    **data, 
-                    "quantity": quantity,
-                    "avg_purchase_price": avg_purchase_price,
-                    "invested_amount": invested_amount,
-                    "current_value": current_value,
-                    "profit_loss": current_value - invested_amount,
-                    "profit_loss_pct": ((current_value - invested_amount) / invested_amount) * 100 if invested_amount > 0 else 0,
-                    "purchases": holding["purchases"]
-                }
-                
-                total_value += current_value
-                total_invested += invested_amount
-                total_change += current_value - invested_amount
-            except Exception as e:
+                data, meta = resilient_call("quote", ticker, YAHOO_HOST, lambda t=ticker: get_stock_data(t),
+                                            QUOTE_DEADLINE, replay_mode)
+            except UpstreamUnavailableError as e:
                 logger.error(f"Error fetching data for {ticker}: {e}")
+                unavailable.append(ticker)
                 continue
+            
+            portfolio_data[ticker] = build_holding_data(data, holding)
+            portfolio_data[ticker]["stale"] = describe_staleness(meta) if meta["stale"] else None
+            try:
+                logo_url, _ = resilient_call("logo", data["name"], "logos", lambda n=data["name"]: get_enhanced_logo_url(n),
+                                             LOGO_DEADLINE, replay_mode)
+            except UpstreamUnavailableError:
+                logo_url = "https://via.placeholder.com/100x100/E50914/FFFFFF?text=📈"
+            portfolio_data[ticker]["logo_url"] = logo_url
         
-        total_change_pct = (total_change / total_invested) * 100 if total_invested > 0 else 0
+        if unavailable:
+            show_error_message(
+                f"No live or recorded data for {', '.join(unavailable)}; these holdings are left out of the totals below.",
+                "warning"
+            )
+        stale_tickers = [ticker for ticker, data in portfolio_data.items() if data["stale"]]
+        if stale_tickers:
+            show_error_message(
+                f"{'Replaying recorded' if replay_mode else 'Upstream data unavailable, showing last known'} "
+                f"prices for {', '.join(stale_tickers)}.", "warning"
+            )
         
-        with col1:
-            st.markdown("""
-            <div class="metric-card">
-                <h3>💰 Total Value</h3>
-                <h2>{}{:,.2f}</h2>
-            </div>
-            """.format(currency, total_value), unsafe_allow_html=True)
+        histories = {}
+        for ticker in portfolio_data:
+            try:
+                histories[ticker] = get_price_history(ticker, replay=replay_mode)
+            except DataFetchError as e:
+                logger.warning(f"No chart history for {ticker}: {e}")
         
-        with col2:
-            change_color = "#46D369" if total_change >= 0 else "#E50914"
-            st.markdown(f"""
-            <div class="metric-card">
-                <h3>📈 Total P&L</h3>
-                <h2 style="color: {change_color};">{currency}{total_change:+.2f}</h2>
-            </div>
-            """, unsafe_allow_html=True)
-        
-        with col3:
-            st.markdown(f"""
-            <div class="metric-card">
-                <h3>💰 Invested</h3>
-                <h2>{currency}{total_invested:,.2f}</h2>
-            </div>
-            """, unsafe_allow_html=True)
-        
-        with col4:
-            change_color = "#46D369" if total_change_pct >= 0 else "#E50914"
-            st.markdown(f"""
-            <div class="metric-card">
-                <h3>📋 Return %</h3>
-                <h2 style="color: {change_color};">{total_change_pct:+.2f}%</h2>
-            </div>
-            """, unsafe_allow_html=True)
-        
-        st.markdown("<br>", unsafe_allow_html=True)
-        
-        # Portfolio tiles
-        cols = st.columns(3)
-        for i, (ticker, data) in enumerate(portfolio_data.items()):
-            with cols[i % 3]:
-                try:
-                    logo_url = get_enhanced_logo_url(data["name"])
-                    current_value = data["current_value"]
-                    invested_amount = data["invested_amount"]
-                    profit_loss = data["profit_loss"]
-                    profit_loss_pct = data["profit_loss_pct"]
-                    change_color = "#46D369" if profit_loss >= 0 else "#E50914"
-                    
-                    if st.button(f"📺 {data['name']}", key=f"select_{ticker}", use_container_width=True):
-                        st.session_state.selected_stock = (data["name"], ticker)
-                        st.rerun()
-                    
-                    st.markdown(f"""
-                    <div class="movie-tile">
-                        <img src="{logo_url}" width="60" style="border-radius: 15px; margin-bottom: 15px;" onerror="this.src='https://via.placeholder.com/60x60/E50914/FFFFFF?text=📈'"/>
-                        <h4 style="margin: 10px 0;">{data['name']}</h4>
-                        <p><strong>Current Price:</strong> {currency}{data['price']:.2f}</p>
-                        <p><strong>Avg. Buy Price:</strong> {currency}{data['avg_purchase_price']:.2f}</p>
-                        <p><strong>Shares:</strong> {data['quantity']}</p>
-                        <p><strong>Invested:</strong> {currency}{invested_amount:,.2f}</p>
-                        <p><strong>Current Value:</strong> {currency}{current_value:,.2f}</p>
-                        <p style="color: {change_color};"><strong>P&L:</strong> {currency}{profit_loss:+.2f} ({profit_loss_pct:+.2f}%)</p>
-                        <p><strong>Sector:</strong> {data['sector']}</p>
-                    </div>
-                    """, unsafe_allow_html=True)
-                    
-                except Exception as e:
-                    show_error_message(f"Error displaying {ticker}: {str(e)}", "warning")
+        # Live mode: only these fragments rerun on a timer, reading prices from the shared bus.
+        # A full rerun rebuilds portfolio_data, so every live view starts over from it.
+        st.session_state.live_cursors = {}
+        st.session_state.live_since = quotes_since
+        if live_prices:
+            bus = live_bus
+            
+            @st.fragment(run_every=live_refresh)
+            def render_metrics():
+                render_portfolio_metrics(with_live_prices(portfolio_data, bus, "metrics"), currency)
+            
+            @st.fragment(run_every=live_refresh)
+            def render_live_quote(ticker: str):
+                live_data = with_live_prices({ticker: portfolio_data[ticker]}, bus, f"tile:{ticker}")
+                render_tile_quote(live_data[ticker], currency)
+            
+            def render_tiles():
+                render_portfolio_tiles(portfolio_data, histories, currency, render_live_quote)
+        else:
+            def render_metrics():
+                render_portfolio_metrics(portfolio_data, currency)
+            
+            def render_tiles():
+                render_portfolio_tiles(portfolio_data, histories, currency)
+        
+        render_metrics()
+        
+        # Portfolio charts (rendered once per data version, then served from cache)
+        chart_col1, chart_col2 = st.columns([1, 2])
+        with chart_col1:
+            st.markdown("### 🥧 Allocation")
+            st.image(render_allocation_chart({
+                ticker: data["current_value"] for ticker, data in portfolio_data.items()
+            }), use_container_width=True)
+        
+        with chart_col2:
+            st.markdown("### 📈 Portfolio Value")
+            equity, invested = portfolio_equity_curve(histories, {
+                ticker: data["purchases"] for ticker, data in portfolio_data.items()
+            })
+            if not equity.empty:
+                st.image(render_equity_curve("portfolio", equity, invested), use_container_width=True)
+            else:
+                st.info("📈 Not enough price history to chart your portfolio yet.")
+        
+        render_tiles()
                     
     except Exception as e:
         show_error_message(f"Error calculating portfolio metrics: {str(e)}")
@@ -757,14 +1019,164 @@ else:
     </div>
     """, unsafe_allow_html=True)
 
+# --- Backtesting ---
+if st.session_state.portfolio:
+    with st.expander("🧪 Backtest Your Holdings", expanded=False):
+        if replay_mode:
+            st.caption("🗄️ Offline Replay: using locally cached price history only")
+        
+        bt_col1, bt_col2, bt_col3 = st.columns(3)
+        
+        with bt_col1:
+            bt_strategy = st.selectbox("Strategy", ["Buy & Hold", "Rebalance to target"], key="bt_strategy")
+            bt_rebalance = st.selectbox("Rebalance every", list(FREQUENCIES), index=1, key="bt_rebalance",
+                                        disabled=bt_strategy == "Buy & Hold")
+        
+        with bt_col2:
+            bt_contribution = st.number_input(f"Contribution ({currency})", min_value=0.0, step=100.0, value=0.0, key="bt_contribution")
+            bt_contribution_freq = st.selectbox("Contribute every", list(FREQUENCIES), index=1, key="bt_contribution_freq")
+        
+        with bt_col3:
+            bt_cost_bps = st.number_input("Trading cost (bps)", min_value=0.0, step=1.0, value=5.0, key="bt_cost_bps")
+            bt_sweep = st.checkbox("Compare all rebalance frequencies", key="bt_sweep",
+                                   help="Runs every strategy/frequency combination in parallel")
+        
+        if st.button("▶️ Run Backtest", key="bt_run"):
+            try:
+                lots = lots_from_portfolio(st.session_state.portfolio)
+                with st.spinner("📚 Loading price history..."):
+                    bt_prices = load_price_history({lot["ticker"] for lot in lots}, lots[0]["date"], offline=replay_mode)
+                
+                bt_params = {
+                    "strategy": "rebalance" if bt_strategy == "Rebalance to target" else "buy_and_hold",
+                    "rebalance_freq": bt_rebalance,
+                    "contribution": bt_contribution,
+                    "contribution_freq": bt_contribution_freq,
+                    "cost_bps": bt_cost_bps
+                }
+                
+                with st.spinner("🧪 Simulating..."):
+                    result = run_backtest(bt_prices, lots, bt_params)
+                
+                stats = result["stats"]
+                m1, m2, m3, m4 = st.columns(4)
+                m1.metric("Final Value", f"{currency}{stats['final_value']:,.2f}", f"{currency}{stats['profit_loss']:+,.2f}")
+                m2.metric("CAGR", f"{stats['cagr'] * 100:+.2f}%")
+                m3.metric("Max Drawdown", f"{stats['max_drawdown'] * 100:.2f}%")
+                m4.metric("Sharpe", f"{stats['sharpe']:.2f}")
+                st.image(render_equity_curve(f"backtest-{sorted(bt_params.items())}", result["equity"], result["invested"],
+                                             persist=False), use_container_width=True)
+                
+                if bt_sweep:
+                    grid = [{**bt_params, "strategy": "buy_and_hold", "rebalance_freq": None}] + [
+                        {**bt_params, "strategy": "rebalance", "rebalance_freq": freq} for freq in FREQUENCIES
+                    ]
+                    with st.spinner("🧪 Running parameter sweep..."):
+                        sweep = run_sweep(bt_prices, lots, grid)
+                    # Buy-and-hold never rebalances, so leave its frequency blank
+                    sweep["rebalance_freq"] = sweep["rebalance_freq"].fillna("")
+                    st.dataframe(sweep[["strategy", "rebalance_freq", "final_value", "cagr", "volatility", "max_drawdown", "sharpe", "costs"]],
+                                 use_container_width=True)
+            
+            except BacktestError as e:
+                show_error_message(f"Backtest failed: {str(e)}", "warning")
+            except Exception as e:
+                show_error_message(f"Unexpected error: {str(e)}")
+
+# --- Optimization & Rebalancing ---
+if st.session_state.portfolio and portfolio_data:
+    with st.expander("🎯 Optimize & Rebalance", expanded=False):
+        if replay_mode:
+            st.caption("🗄️ Offline Replay: using locally cached price history only")
+        
+        opt_col1, opt_col2, opt_col3 = st.columns(3)
+        
+        with opt_col1:
+            opt_method_label = st.selectbox("Method", ["Mean-Variance", "Minimum Variance", "Risk Parity"], key="opt_method")
+            opt_risk_aversion = st.slider("Risk aversion", min_value=0.5, max_value=10.0, value=3.0, step=0.5,
+                                          key="opt_risk_aversion", disabled=opt_method_label != "Mean-Variance")
+        
+        with opt_col2:
+            opt_max_weight = st.slider("Max position (%)", min_value=5, max_value=100, value=40, step=5, key="opt_max_weight")
+            opt_sector_cap = st.slider("Max per sector (%)", min_value=10, max_value=100, value=60, step=5, key="opt_sector_cap")
+        
+        with opt_col3:
+            opt_band = st.slider("Ignore drift below (%)", min_value=0.0, max_value=10.0, value=2.0, step=0.5, key="opt_band")
+            opt_cash = st.number_input(f"Cash to invest ({currency})", min_value=0.0, step=100.0, value=0.0, key="opt_cash")
+        
+        if st.button("🎯 Propose Rebalance", key="opt_run"):
+            try:
+                tickers = list(portfolio_data)
+                start = (datetime.now() - timedelta(days=3 * 365)).strftime("%Y-%m-%d")
+                with st.spinner("📚 Loading price history..."):
+                    opt_prices = load_price_history(tickers, start, offline=replay_mode)
+                
+                method = {"Mean-Variance": "mean_variance", "Minimum Variance": "min_variance", "Risk Parity": "risk_parity"}[opt_method_label]
+                targets = optimize_portfolio(
+                    opt_prices, tickers, method,
+                    risk_aversion=opt_risk_aversion,
+                    max_weight=opt_max_weight / 100,
+                    sector_of={ticker: data["sector"] for ticker, data in portfolio_data.items()},
+                    sector_cap=opt_sector_cap / 100
+                )
+                
+                total_value = sum(data["current_value"] for data in portfolio_data.values())
+                st.dataframe(pd.DataFrame([
+                    {
+                        "Ticker": ticker,
+                        "Sector": portfolio_data[ticker]["sector"],
+                        "Current %": round(portfolio_data[ticker]["current_value"] / total_value * 100, 2) if total_value > 0 else 0.0,
+                        "Target %": round(weight * 100, 2)
+                    }
+                    for ticker, weight in targets.items()
+                ]), use_container_width=True, hide_index=True)
+                
+                trades = generate_trades(
+                    st.session_state.portfolio,
+                    {ticker: data["price"] for ticker, data in portfolio_data.items()},
+                    targets, cash=opt_cash, band=opt_band / 100
+                )
+                
+                if trades:
+                    st.markdown("#### 🔁 Proposed Trades")
+                    st.dataframe(pd.DataFrame([
+                        {
+                            "Action": trade["action"],
+                            "Ticker": trade["ticker"],
+                            "Shares": trade["quantity"],
+                            "Value": round(trade["value"], 2),
+                            "Realized Gain": round(trade["realized_gain"], 2),
+                            "Est. Tax": round(trade["estimated_tax"], 2)
+                        }
+                        for trade in trades
+                    ]), use_container_width=True, hide_index=True)
+                    st.caption(f"Estimated tax impact: {currency}{sum(trade['estimated_tax'] for trade in trades):+,.2f} "
+                               "(sells use losing and long-term lots first)")
+                else:
+                    st.success("✅ Your holdings are already within the drift band of the target weights.")
+            
+            except (OptimizationError, BacktestError) as e:
+                show_error_message(f"Optimization failed: {str(e)}", "warning")
+            except Exception as e:
+                show_error_message(f"Unexpected error: {str(e)}")
+
 # --- Enhanced News Section ---
 if st.session_state.get("selected_stock"):
     name, ticker = st.session_state.selected_stock
     st.markdown(f"## 📺 {name} - Latest Updates")
     
+    try:
+        st.image(render_price_chart(ticker, get_price_history(ticker, replay=replay_mode), f"{ticker} · 1Y"), use_container_width=True)
+    except DataFetchError as e:
+        show_error_message(f"Price chart unavailable: {str(e)}", "warning")
+    
     try:
         with st.spinner("📰 Loading latest news..."):
-            news_list = fetch_enhanced_news(name)
+            news_list, news_meta = resilient_call("news", name, NEWS_HOST, lambda: fetch_enhanced_news(name),
+                                                  NEWS_DEADLINE, replay_mode)
+        
+        if news_meta["stale"]:
+            st.caption(f"⏳ Showing recorded news {describe_staleness(news_meta)}")
         
         if news_list:
             st.markdown('<div class="news-carousel">', unsafe_allow_html=True)
@@ -0,0 +1,364 @@
+# Backtesting engine for portfolio lots and rebalancing rules
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+import yfinance as yf
+
+logger = logging.getLogger(__name__)
+
+# --- Backtest Settings ---
+PRICE_CACHE_DIR = os.environ.get("PORTFOLIO_PRICE_CACHE", ".price_cache")
+TRADING_DAYS = 252
+POOL_MIN_SECONDS = 2.0  # estimated serial sweep time below which starting a process pool costs more than it saves
+LISTING_GAP = pd.Timedelta(days=7)   # first row this far past the covered start means a later listing
+EMPTY_RETRY = 3600.0    # seconds before re-asking for a recent range that came back empty
+FREQUENCIES = {"weekly": "W", "monthly": "M", "quarterly": "Q", "yearly": "Y"}
+
+DEFAULT_PARAMS = {
+    "strategy": "buy_and_hold",      # buy_and_hold | rebalance
+    "rebalance_freq": "quarterly",   # key of FREQUENCIES
+    "target_weights": None,          # {ticker: weight}; defaults to cost-basis weights
+    "contribution": 0.0,             # cash added on each contribution date
+    "contribution_freq": "monthly",  # key of FREQUENCIES
+    "cost_bps": 0.0,                 # transaction cost per unit of traded value
+    "start": None,                   # defaults to the first purchase date
+}
+
+class BacktestError(Exception):
+    """Raised when a backtest cannot be run"""
+    pass
+
+# --- Local Price History ---
+def _cache_path(ticker: str, cache_dir: str, ext: str = "csv") -> str:
+    return os.path.join(cache_dir, f"{ticker.replace('/', '_')}.{ext}")
+
+def _read_cached(ticker: str, cache_dir: str) -> pd.Series:
+    path = _cache_path(ticker, cache_dir)
+    if not os.path.exists(path):
+        return pd.Series(dtype=float, name=ticker)
+    series = pd.read_csv(path, index_col=0, parse_dates=True).iloc[:, 0]
+    series.name = ticker
+    return series
+
+def _read_coverage(ticker: str, cache_dir: str) -> Optional[Dict[str, str]]:
+    """Date range already requested for a ticker ({"start", "end"}), if known"""
+    path = _cache_path(ticker, cache_dir, "json")
+    if not os.path.exists(_cache_path(ticker, cache_dir)) or not os.path.exists(path):
+        return None
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+def _download_closes(tickers: List[str], start: pd.Timestamp, end: Optional[pd.Timestamp] = None) -> pd.DataFrame:
+    """One batched download of adjusted closes; ``end`` is exclusive"""
+    frame = yf.download(tickers, start=start.strftime("%Y-%m-%d"),
+                        end=end.strftime("%Y-%m-%d") if end is not None else None,
+                        auto_adjust=True, progress=False, group_by="column", threads=True)
+    if frame is None or frame.empty:
+        return pd.DataFrame()
+    closes = frame["Close"]
+    if isinstance(closes, pd.Series):
+        closes = closes.to_frame(tickers[0])
+    closes.index = pd.DatetimeIndex(closes.index).tz_localize(None).normalize()
+    return closes
+
+_empty_until: Dict[tuple, float] = {}
+
+def load_price_history(tickers: Iterable[str], start: str, cache_dir: str = PRICE_CACHE_DIR,
+                       offline: bool = False) -> pd.DataFrame:
+    """Load adjusted daily closes from the local cache, downloading only missing ranges
+
+    Next to each cached CSV a small JSON file records the date range
+    already requested, so a ticker listed after ``start`` or a market
+    holiday does not look like a gap. Only the missing head (before the
+    covered start) and tail (after the covered end) are downloaded,
+    batched across tickers that miss the same range. With ``offline``
+    nothing is downloaded and only the cached closes are used.
+    """
+    tickers = sorted(set(tickers))
+    start_ts = pd.Timestamp(start).normalize()
+    # Today's bar may still be moving, so coverage only ever extends to the last full session
+    last_session = (pd.Timestamp.today().normalize() - pd.tseries.offsets.BDay(1))
+
+    cached = {ticker: _read_cached(ticker, cache_dir) for ticker in tickers}
+    coverage = {ticker: _read_coverage(ticker, cache_dir) for ticker in tickers}
+
+    # (start, end) -> tickers missing that range; end None means "up to now"
+    ranges: Dict[tuple, List[str]] = {}
+    now = time.time()
+    for ticker in ([] if offline else tickers):
+        covered = coverage[ticker]
+        if covered is None:
+            if _empty_until.get((cache_dir, ticker, "tail"), 0) <= now:
+                ranges.setdefault((start_ts, None), []).append(ticker)
+            continue
+        covered_start, covered_end = pd.Timestamp(covered["start"]), pd.Timestamp(covered["end"])
+        if start_ts < covered_start and _empty_until.get((cache_dir, ticker, "head"), 0) <= now:
+            ranges.setdefault((start_ts, covered_start), []).append(ticker)
+        if covered_end < last_session and _empty_until.get((cache_dir, ticker, "tail"), 0) <= now:
+            ranges.setdefault((covered_end + pd.Timedelta(days=1), None), []).append(ticker)
+
+    updated = set()
+    for (fetch_start, fetch_end), missing in sorted(ranges.items(), key=lambda item: str(item[0])):
+        closes = _download_closes(missing, fetch_start, fetch_end)
+        # Rows for any ticker in the batch show the download itself worked
+        batch_ok = any(closes[t].notna().any() for t in missing if t in closes)
+        for ticker in missing:
+            series = closes[ticker].dropna() if ticker in closes else pd.Series(dtype=float)
+            if series.empty:
+                # An empty head is "not listed yet" only if the download worked or the
+                # ticker's earlier data already starts well after the covered start
+                previous = coverage[ticker]
+                listed_later = (
+                    previous is not None and not cached[ticker].empty
+                    and cached[ticker].index[0] - pd.Timestamp(previous["start"]) > LISTING_GAP
+                )
+                if fetch_end is None or not (batch_ok or listed_later):
+                    # A holiday, or the network is down: keep the coverage as it was so
+                    # nothing is skipped, but don't ask again on every click
+                    _empty_until[(cache_dir, ticker, "tail" if fetch_end is None else "head")] = now + EMPTY_RETRY
+                    logger.warning(f"No price history downloaded for {ticker} from {fetch_start:%Y-%m-%d}")
+                    continue
+            else:
+                merged = pd.concat([cached[ticker], series])
+                merged = merged[~merged.index.duplicated(keep="last")].sort_index()
+                merged.name = ticker
+                cached[ticker] = merged
+            previous = coverage[ticker]
+            covered_start = fetch_start if previous is None else min(pd.Timestamp(previous["start"]), fetch_start)
+            covered_end = last_session if fetch_end is None else pd.Timestamp(previous["end"])
+            coverage[ticker] = {"start": covered_start.strftime("%Y-%m-%d"), "end": covered_end.strftime("%Y-%m-%d")}
+            updated.add(ticker)
+
+    if updated:
+        os.makedirs(cache_dir, exist_ok=True)
+        for ticker in updated:
+            cached[ticker].to_frame().to_csv(_cache_path(ticker, cache_dir))
+            with open(_cache_path(ticker, cache_dir, "json"), "w") as fh:
+                json.dump(coverage[ticker], fh)
+
+    prices = pd.DataFrame({t: s for t, s in cached.items() if not s.empty})
+    if prices.empty:
+        raise BacktestError("No historical prices available for the portfolio")
+    return prices.sort_index().ffill().loc[start_ts:]
+
+def lots_from_portfolio(portfolio: Dict[str, Dict]) -> List[Dict]:
+    """Flatten session-state holdings into dated purchase lots"""
+    lots = []
+    for ticker, holding in portfolio.items():
+        for purchase in holding.get("purchases", []):
+            lots.append({
+                "ticker": ticker,
+                "date": purchase["date"],
+                "quantity": float(purchase["quantity"]),
+                "price": float(purchase["price"]),
+            })
+    return sorted(lots, key=lambda lot: lot["date"])
+
+# --- Engine ---
+def _schedule(index: pd.DatetimeIndex, freq: str) -> pd.DatetimeIndex:
+    """First trading day of every period after the first one"""
+    periods = index.to_period(FREQUENCIES[freq])
+    firsts = pd.Series(index, index=index).groupby(periods).first()
+    return pd.DatetimeIndex(firsts.iloc[1:].to_numpy())
+
+def _to_session(index: pd.DatetimeIndex, date) -> Optional[int]:
+    """Position of the first trading day on or after ``date``"""
+    pos = index.searchsorted(pd.Timestamp(date).normalize())
+    return int(pos) if pos < len(index) else None
+
+def run_backtest(prices: pd.DataFrame, lots: List[Dict], params: Optional[Dict] = None) -> Dict:
+    """Simulate lots plus a strategy over daily prices
+
+    Holdings only change on event days (purchases, contributions,
+    rebalances), so the loop runs once per event and the daily value
+    series is produced with array operations.
+    """
+    params = {**DEFAULT_PARAMS, **(params or {})}
+    if not lots:
+        raise BacktestError("Portfolio has no purchase lots to backtest")
+
+    tickers = sorted({lot["ticker"] for lot in lots} & set(prices.columns))
+    if not tickers:
+        raise BacktestError("No price history for any held ticker")
+
+    start = pd.Timestamp(params["start"] or lots[0]["date"]).normalize()
+    frame = prices.loc[start:, tickers].ffill().dropna(how="all")
+    if len(frame) < 2:
+        raise BacktestError("Not enough price history after the start date")
+
+    index = frame.index
+    px = frame.to_numpy(dtype=float)
+    n_days, n_assets = px.shape
+    col = {ticker: i for i, ticker in enumerate(tickers)}
+
+    # Target weights default to each ticker's share of total cost basis
+    weights = params["target_weights"]
+    if not weights:
+        cost = {t: 0.0 for t in tickers}
+        for lot in lots:
+            if lot["ticker"] in cost:
+                cost[lot["ticker"]] += lot["quantity"] * lot["price"]
+        weights = cost
+    w = np.array([max(float(weights.get(t, 0.0)), 0.0) for t in tickers])
+    if w.sum() <= 0:
+        raise BacktestError("Target weights must contain at least one positive weight")
+    w = w / w.sum()
+
+    # Collect events per trading day
+    lot_events: Dict[int, np.ndarray] = {}
+    flows = np.zeros(n_days)
+    for lot in lots:
+        if lot["ticker"] not in col:
+            continue
+        pos = _to_session(index, max(pd.Timestamp(lot["date"]), start))
+        if pos is None:
+            continue
+        lot_events.setdefault(pos, np.zeros(n_assets))[col[lot["ticker"]]] += lot["quantity"]
+        flows[pos] += lot["quantity"] * lot["price"]
+
+    contribution_days = set()
+    if params["contribution"] > 0:
+        contribution_days = {int(index.get_loc(d)) for d in _schedule(index, params["contribution_freq"])}
+        for pos in contribution_days:
+            flows[pos] += params["contribution"]
+
+    rebalance_days = set()
+    if params["strategy"] == "rebalance":
+        rebalance_days = {int(index.get_loc(d)) for d in _schedule(index, params["rebalance_freq"])}
+
+    cost_rate = params["cost_bps"] / 10_000
+    deltas = np.zeros((n_days, n_assets))
+    cash_deltas = np.zeros(n_days)
+    costs = np.zeros(n_days)
+    holdings = np.zeros(n_assets)
+    cash = 0.0
+
+    for pos in sorted(set(lot_events) | contribution_days | rebalance_days):
+        row = np.nan_to_num(px[pos])
+        tradable = row > 0
+        before = holdings.copy()
+        cash_before = cash
+
+        if pos in lot_events:
+            holdings = holdings + lot_events[pos]
+        if pos in contribution_days:
+            cash += params["contribution"]
+
+        if pos in rebalance_days or (pos in contribution_days and cash > 0):
+            if pos in rebalance_days:
+                budget = holdings[tradable] @ row[tradable] + cash
+                target = holdings.copy()
+                target[tradable] = budget * w[tradable] / w[tradable].sum() / row[tradable]
+            else:
+                # Contributions between rebalances are invested at the target weights
+                target = holdings.copy()
+                target[tradable] += cash * w[tradable] / w[tradable].sum() / row[tradable]
+            traded = np.abs(target - holdings)[tradable] @ row[tradable]
+            costs[pos] = traded * cost_rate
+            cash = (holdings - target)[tradable] @ row[tradable] + cash - costs[pos]
+            holdings = target
+
+        deltas[pos] = holdings - before
+        cash_deltas[pos] = cash - cash_before
+
+    held = np.cumsum(deltas, axis=0)
+    cash_series = np.cumsum(cash_deltas)
+    values = np.nansum(held * np.nan_to_num(px), axis=1) + cash_series
+    invested = np.cumsum(flows)
+
+    equity = pd.Series(values, index=index, name="value")
+    invested_series = pd.Series(invested, index=index, name="invested")
+    active = invested_series > 0
+    return {
+        "params": params,
+        "equity": equity[active],
+        "invested": invested_series[active],
+        "holdings": pd.DataFrame(held, index=index, columns=tickers)[active],
+        "stats": summarize(equity[active], pd.Series(flows, index=index)[active], costs.sum()),
+    }
+
+def summarize(equity: pd.Series, flows: pd.Series, total_costs: float = 0.0) -> Dict:
+    """Flow-adjusted (time-weighted) performance statistics"""
+    values = equity.to_numpy(dtype=float)
+    cash_in = flows.to_numpy(dtype=float)
+    prev = np.concatenate([[np.nan], values[:-1]])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        daily = (values - cash_in) / prev - 1.0
+    daily = np.where(np.isfinite(daily), daily, 0.0)
+
+    growth = np.cumprod(1.0 + daily)
+    drawdown = growth / np.maximum.accumulate(growth) - 1.0
+    years = max((equity.index[-1] - equity.index[0]).days / 365.25, 1 / TRADING_DAYS)
+    volatility = daily.std() * np.sqrt(TRADING_DAYS)
+    total_invested = cash_in.sum()
+
+    return {
+        "final_value": float(values[-1]),
+        "total_invested": float(total_invested),
+        "profit_loss": float(values[-1] - total_invested),
+        "time_weighted_return": float(growth[-1] - 1.0),
+        "cagr": float(growth[-1] ** (1 / years) - 1.0),
+        "volatility": float(volatility),
+        "sharpe": float(daily.mean() * TRADING_DAYS / volatility) if volatility > 0 else 0.0,
+        "max_drawdown": float(drawdown.min()),
+        "costs": float(total_costs),
+    }
+
+# --- Parameter Sweeps ---
+def expand_grid(**options) -> List[Dict]:
+    """Cartesian product of parameter options, e.g. rebalance_freq=["monthly", "yearly"]"""
+    keys = list(options)
+    return [dict(zip(keys, values)) for values in itertools.product(*(options[k] for k in keys))]
+
+# Only ever set inside spawned sweep workers; the server process shares its
+# module globals between session threads, so it passes data explicitly
+_worker_prices: Optional[pd.DataFrame] = None
+_worker_lots: Optional[List[Dict]] = None
+
+def _init_worker(prices: pd.DataFrame, lots: List[Dict]):
+    global _worker_prices, _worker_lots
+    _worker_prices, _worker_lots = prices, lots
+
+def _run_one(prices: pd.DataFrame, lots: List[Dict], params: Dict) -> Dict:
+    try:
+        return {**params, **run_backtest(prices, lots, params)["stats"]}
+    except BacktestError as e:
+        return {**params, "error": str(e)}
+
+def _run_params(params: Dict) -> Dict:
+    return _run_one(_worker_prices, _worker_lots, params)
+
+def run_sweep(prices: pd.DataFrame, lots: List[Dict], grid: List[Dict], max_workers: Optional[int] = None) -> pd.DataFrame:
+    """Run one backtest per parameter set, across a process pool when the sweep is big enough
+
+    The first backtest runs in-process and its timing decides the rest:
+    a spawned pool takes a fair fraction of a second to start, so small
+    sweeps simply continue serially.
+    """
+    started = time.perf_counter()
+    results = [_run_one(prices, lots, params) for params in grid[:1]]
+    remaining = grid[1:]
+    workers = min(max_workers or os.cpu_count() or 1, len(remaining))
+    estimate = (time.perf_counter() - started) * len(remaining)
+
+    if workers <= 1 or estimate < POOL_MIN_SECONDS:
+        results += [_run_one(prices, lots, params) for params in remaining]
+        return pd.DataFrame(results)
+
+    # Spawn keeps workers clear of the server's threads; prices/lots are sent once per worker
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_worker, initargs=(prices, lots)) as pool:
+        results += list(pool.map(_run_params, remaining))
+    return pd.DataFrame(results)
@@ -0,0 +1,333 @@
+# Cached, pre-rendered charts for the portfolio tracker
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from matplotlib.figure import Figure
+
+logger = logging.getLogger(__name__)
+
+# --- Chart Settings ---
+CHART_CACHE_DIR = os.environ.get("PORTFOLIO_CHART_CACHE", ".chart_cache")
+MEMORY_CACHE_SIZE = 256
+DISK_CACHE_MAX_BYTES = int(float(os.environ.get("PORTFOLIO_CHART_CACHE_MB", "64")) * 2 ** 20)
+DISK_CACHE_MAX_AGE = 7 * 86400    # seconds an unused PNG is kept on disk
+PRUNE_EVERY = 50                  # disk writes between cache sweeps
+SPARKLINE_POINTS = 60
+DETAIL_POINTS = 400
+
+NETFLIX_RED = "#E50914"
+PROFIT_GREEN = "#46D369"
+BACKGROUND = "#141414"
+TILE_BACKGROUND = "#1c1c1c"
+ALLOCATION_COLORS = [
+    "#E50914", "#46D369", "#F5C518", "#1F8FFF", "#B20710",
+    "#9B59B6", "#FF7F50", "#20B2AA", "#D3D3D3", "#8B4513"
+]
+
+# --- Downsampling ---
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Downsample a series with Largest-Triangle-Three-Buckets"""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return x, y
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    out_idx = np.empty(n_out, dtype=np.int64)
+    out_idx[0] = 0
+    out_idx[-1] = n - 1
+
+    # Buckets cover the points between the fixed first and last samples
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    prev = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = end, edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        bucket_x = x[start:end]
+        bucket_y = y[start:end]
+        areas = np.abs(
+            (x[prev] - avg_x) * (bucket_y - y[prev])
+            - (x[prev] - bucket_x) * (avg_y - y[prev])
+        )
+        prev = start + int(np.argmax(areas))
+        out_idx[i + 1] = prev
+
+    return x[out_idx], y[out_idx]
+
+def downsample_series(series: pd.Series, n_out: int) -> pd.Series:
+    """Downsample a datetime-indexed series while keeping its shape"""
+    series = series.dropna()
+    if len(series) <= n_out:
+        return series
+
+    x = np.arange(len(series), dtype=float)
+    sampled_x, _ = lttb(x, series.to_numpy(dtype=float), n_out)
+    return series.iloc[sampled_x.astype(np.int64)]
+
+def series_version(series: pd.Series) -> str:
+    """Identify a price series by its length and last observation"""
+    if series is None or series.empty:
+        return "empty"
+    return f"{len(series)}-{series.index[-1]}-{float(series.iloc[-1]):.6f}"
+
+# --- Image Cache ---
+class ChartCache:
+    """Two-level (memory + disk) cache of rendered PNG charts"""
+
+    def __init__(self, cache_dir: Optional[str] = CHART_CACHE_DIR, max_items: int = MEMORY_CACHE_SIZE,
+                 max_disk_bytes: int = DISK_CACHE_MAX_BYTES, max_age: float = DISK_CACHE_MAX_AGE):
+        self.cache_dir = cache_dir
+        self.max_items = max_items
+        self.max_disk_bytes = max_disk_bytes
+        self.max_age = max_age
+        self._items: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # Sweep leftovers from earlier runs on the first write
+        self._writes_since_prune = PRUNE_EVERY
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """Build a stable cache key from chart identity parts"""
+        raw = "|".join(str(part) for part in parts)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Optional[str]:
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, f"{key}.png")
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return cached image bytes from memory or disk"""
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+
+        path = self._path(key)
+        if path and os.path.exists(path):
+            try:
+                with open(path, "rb") as fh:
+                    image = fh.read()
+                # Mark as recently used so pruning evicts the coldest files first
+                os.utime(path)
+                self._remember(key, image)
+                with self._lock:
+                    self.hits += 1
+                return image
+            except OSError as e:
+                logger.warning(f"Failed to read cached chart {path}: {str(e)}")
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, image: bytes, persist: bool = True):
+        """Store image bytes in memory and, when ``persist`` is set, on disk"""
+        self._remember(key, image)
+        path = self._path(key) if persist else None
+        if not path:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as fh:
+                fh.write(image)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write cached chart {path}: {str(e)}")
+            return
+
+        with self._lock:
+            self._writes_since_prune += 1
+            due = self._writes_since_prune >= PRUNE_EVERY
+            if due:
+                self._writes_since_prune = 0
+        if due:
+            self.prune()
+
+    def prune(self) -> int:
+        """Delete disk entries past the age limit, then the oldest until under the size limit"""
+        if not self.cache_dir or not os.path.isdir(self.cache_dir):
+            return 0
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".png"):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        entries.sort()
+        cutoff = time.time() - self.max_age
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for mtime, size, path in entries:
+            if mtime >= cutoff and total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+            total -= size
+        if removed:
+            logger.info(f"Pruned {removed} cached charts from {self.cache_dir}")
+        return removed
+
+    def _remember(self, key: str, image: bytes):
+        with self._lock:
+            self._items[key] = image
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+# Process-wide cache shared by every session
+chart_cache = ChartCache()
+
+def _cached_render(key: str, render, persist: bool = True) -> bytes:
+    image = chart_cache.get(key)
+    if image is None:
+        image = render()
+        chart_cache.put(key, image, persist)
+    return image
+
+def _figure_to_png(fig: Figure, transparent: bool = False) -> bytes:
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", facecolor=fig.get_facecolor(), transparent=transparent, bbox_inches="tight", pad_inches=0.05)
+    return buffer.getvalue()
+
+def _style_axes(ax):
+    ax.set_facecolor(TILE_BACKGROUND)
+    ax.tick_params(colors="#999999", labelsize=8)
+    for spine in ax.spines.values():
+        spine.set_color("#333333")
+    ax.grid(color="#333333", linewidth=0.5, alpha=0.6)
+
+# --- Chart Renderers ---
+def render_sparkline(ticker: str, closes: pd.Series) -> bytes:
+    """Render a small trend line for a portfolio tile"""
+    key = ChartCache.make_key("sparkline", ticker, series_version(closes), SPARKLINE_POINTS)
+
+    def render() -> bytes:
+        series = downsample_series(closes, SPARKLINE_POINTS)
+        values = series.to_numpy(dtype=float)
+        color = PROFIT_GREEN if len(values) < 2 or values[-1] >= values[0] else NETFLIX_RED
+
+        fig = Figure(figsize=(3.0, 0.8), dpi=100)
+        ax = fig.add_subplot(111)
+        x = np.arange(len(values))
+        ax.plot(x, values, color=color, linewidth=1.8)
+        if len(values):
+            ax.fill_between(x, values, values.min(), color=color, alpha=0.15)
+        ax.axis("off")
+        ax.margins(x=0)
+        return _figure_to_png(fig, transparent=True)
+
+    return _cached_render(key, render)
+
+def render_price_chart(ticker: str, closes: pd.Series, title: str = "") -> bytes:
+    """Render the detailed price history chart for a holding"""
+    key = ChartCache.make_key("detail", ticker, series_version(closes), DETAIL_POINTS, title)
+
+    def render() -> bytes:
+        series = downsample_series(closes, DETAIL_POINTS)
+        fig = Figure(figsize=(9, 3.2), dpi=100, facecolor=BACKGROUND)
+        ax = fig.add_subplot(111)
+        _style_axes(ax)
+        ax.plot(series.index, series.to_numpy(dtype=float), color=NETFLIX_RED, linewidth=1.6)
+        if title:
+            ax.set_title(title, color="white", fontsize=11, loc="left")
+        fig.autofmt_xdate()
+        return _figure_to_png(fig)
+
+    return _cached_render(key, render)
+
+def render_allocation_chart(values: Dict[str, float]) -> bytes:
+    """Render a donut chart of current value per holding"""
+    items = sorted(((k, v) for k, v in values.items() if v > 0), key=lambda kv: kv[1], reverse=True)
+    key = ChartCache.make_key("allocation", tuple((k, round(v, 2)) for k, v in items))
+
+    def render() -> bytes:
+        fig = Figure(figsize=(4.5, 4.5), dpi=100, facecolor=BACKGROUND)
+        ax = fig.add_subplot(111)
+        if items:
+            labels, sizes = zip(*items)
+            colors = [ALLOCATION_COLORS[i % len(ALLOCATION_COLORS)] for i in range(len(sizes))]
+            ax.pie(
+                sizes, labels=labels, colors=colors, autopct="%1.0f%%", startangle=90,
+                wedgeprops={"width": 0.4, "edgecolor": BACKGROUND},
+                textprops={"color": "white", "fontsize": 9}
+            )
+        ax.set_aspect("equal")
+        return _figure_to_png(fig)
+
+    # Keyed on live values, so it changes with nearly every quote; not worth keeping on disk
+    return _cached_render(key, render, persist=False)
+
+def render_equity_curve(label: str, equity: pd.Series, invested: Optional[pd.Series] = None,
+                        persist: bool = True) -> bytes:
+    """Render portfolio value over time, optionally against money invested"""
+    key = ChartCache.make_key(
+        "equity", label, series_version(equity),
+        series_version(invested) if invested is not None else "-", DETAIL_POINTS
+    )
+
+    def render() -> bytes:
+        fig = Figure(figsize=(9, 3.2), dpi=100, facecolor=BACKGROUND)
+        ax = fig.add_subplot(111)
+        _style_axes(ax)
+        series = downsample_series(equity, DETAIL_POINTS)
+        ax.plot(series.index, series.to_numpy(dtype=float), color=PROFIT_GREEN, linewidth=1.6, label="Value")
+        if invested is not None and not invested.empty:
+            invested_series = downsample_series(invested, DETAIL_POINTS)
+            ax.plot(invested_series.index, invested_series.to_numpy(dtype=float), color="#999999",
+                    linewidth=1.2, linestyle="--", label="Invested")
+            ax.legend(facecolor=TILE_BACKGROUND, edgecolor="#333333", labelcolor="white", fontsize=8)
+        fig.autofmt_xdate()
+        return _figure_to_png(fig)
+
+    return _cached_render(key, render, persist)
+
+def portfolio_equity_curve(histories: Dict[str, pd.Series], holdings: Dict[str, Sequence[Dict]]) -> Tuple[pd.Series, pd.Series]:
+    """Build value and invested-capital series from purchase lots and closes"""
+    frames = {ticker: series for ticker, series in histories.items() if series is not None and not series.empty}
+    if not frames:
+        return pd.Series(dtype=float), pd.Series(dtype=float)
+
+    closes = pd.DataFrame(frames).sort_index().ffill()
+    index = closes.index
+    value = pd.Series(0.0, index=index)
+    invested = pd.Series(0.0, index=index)
+
+    for ticker, purchases in holdings.items():
+        if ticker not in closes:
+            continue
+        held = pd.Series(0.0, index=index)
+        cost = pd.Series(0.0, index=index)
+        for lot in purchases:
+            lot_date = pd.Timestamp(lot["date"])
+            if index.tz is not None and lot_date.tz is None:
+                lot_date = lot_date.tz_localize(index.tz)
+            mask = index >= lot_date
+            held[mask] += lot["quantity"]
+            cost[mask] += lot["quantity"] * lot["price"]
+        value += held * closes[ticker].fillna(0.0)
+        invested += cost
+
+    active = invested > 0
+    return value[active], invested[active]
@@ -0,0 +1,232 @@
+# Split and dividend processing for purchase lots
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List
+
+import pandas as pd
+import yfinance as yf
+
+from snapshots import CircuitBreaker, UpstreamBusyError, breaker_for, call_with_deadline
+
+logger = logging.getLogger(__name__)
+
+# --- Corporate Action Settings ---
+ACTIONS_CACHE_FILE = os.environ.get("PORTFOLIO_ACTIONS_CACHE", ".corporate_actions.json")
+REFRESH_HOURS = 12
+FAILURE_BACKOFF = 900.0   # seconds before retrying tickers whose fetch failed
+FETCH_DEADLINE = 4.0      # seconds a page waits on a download before moving on
+ACTIONS_HOST = "finance.yahoo.com"
+
+# Guards the cache file and the bookkeeping below, never held during a download
+_cache_lock = threading.Lock()
+_in_flight: set = set()
+_failed_at: Dict[str, float] = {}
+
+# --- Local Cache ---
+def _load_cache(path: str = ACTIONS_CACHE_FILE) -> Dict[str, Dict]:
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable corporate action cache {path}: {str(e)}")
+        return {}
+
+def _save_cache(cache: Dict[str, Dict], path: str = ACTIONS_CACHE_FILE):
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as fh:
+        json.dump(cache, fh, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def fetch_actions(tickers: List[str], start: str) -> Dict[str, Dict]:
+    """Download split and dividend events for all tickers in one batch
+
+    Tickers that came back without any price rows are left out, so their
+    cache entries stay stale and are fetched again later.
+    """
+    frame = yf.download(tickers, start=start, actions=True, auto_adjust=False,
+                        progress=False, group_by="column", threads=True)
+    # yfinance reports failures as missing rows, not exceptions. Caching that as
+    # "no events" would let lots skip past real dividends, so treat it as an error.
+    if frame is None or frame.empty:
+        raise ValueError(f"No data returned for {', '.join(tickers)}")
+    closes = frame["Close"]
+    if isinstance(closes, pd.Series):
+        closes = closes.to_frame(tickers[0])
+    received = [ticker for ticker in tickers if ticker in closes and closes[ticker].notna().any()]
+    if not received:
+        raise ValueError(f"No data returned for {', '.join(tickers)}")
+    events = {ticker: {"splits": [], "dividends": []} for ticker in received}
+
+    for column, key in (("Stock Splits", "splits"), ("Dividends", "dividends")):
+        if column not in frame:
+            continue
+        values = frame[column]
+        if isinstance(values, pd.Series):
+            values = values.to_frame(tickers[0])
+        for ticker in values.columns:
+            if str(ticker) not in events:
+                continue
+            series = values[ticker].dropna()
+            series = series[series > 0]
+            events[str(ticker)][key] = [
+                [pd.Timestamp(ts).strftime("%Y-%m-%d"), float(amount)] for ts, amount in series.items()
+            ]
+    return events
+
+def _refresh(tickers: List[str], start: str, fetched_at: datetime, breaker: CircuitBreaker):
+    """Download events for ``tickers`` and merge them into the cache file"""
+    try:
+        fetched = fetch_actions(tickers, start)
+        breaker.record_success()
+        with _cache_lock:
+            # Re-read: other sessions may have saved while this download ran
+            cache = _load_cache()
+            for ticker, events in fetched.items():
+                cache[ticker] = {**events, "start": start, "fetched_at": fetched_at.isoformat()}
+            _save_cache(cache)
+            for ticker in tickers:
+                if ticker in fetched:
+                    _failed_at.pop(ticker, None)
+                else:
+                    _failed_at[ticker] = time.time()
+    except Exception as e:
+        # Stale events are still better than none; retry after the backoff
+        logger.error(f"Failed to fetch corporate actions for {', '.join(tickers)}: {str(e)}")
+        breaker.record_failure()
+        with _cache_lock:
+            for ticker in tickers:
+                _failed_at[ticker] = time.time()
+    finally:
+        with _cache_lock:
+            _in_flight.difference_update(tickers)
+
+def get_actions(tickers: Iterable[str], start: str, max_age_hours: float = REFRESH_HOURS,
+                deadline: float = FETCH_DEADLINE) -> Dict[str, Dict]:
+    """Return cached events, re-fetching only tickers whose cache is stale
+
+    Tickers another session is already fetching, or whose last fetch
+    failed within FAILURE_BACKOFF, are served from the cache as-is. So
+    is everything while the Yahoo breaker is open. A download that takes
+    longer than ``deadline`` finishes in the background and lands in the
+    cache for a later rerun.
+    """
+    tickers = sorted(set(tickers))
+    now = datetime.now()
+    with _cache_lock:
+        cache = _load_cache()
+        stale = [
+            ticker for ticker in tickers
+            if (ticker not in cache
+                or cache[ticker]["start"] > start
+                or now - datetime.fromisoformat(cache[ticker]["fetched_at"]) > timedelta(hours=max_age_hours))
+            and ticker not in _in_flight
+            and time.time() - _failed_at.get(ticker, 0) >= FAILURE_BACKOFF
+        ]
+        _in_flight.update(stale)
+
+    if stale:
+        breaker = breaker_for(ACTIONS_HOST)
+        if not breaker.allow():
+            logger.warning(f"Skipping corporate action fetch for {', '.join(stale)}: circuit open")
+            with _cache_lock:
+                _in_flight.difference_update(stale)
+            return {ticker: cache[ticker] for ticker in tickers if ticker in cache}
+        try:
+            call_with_deadline(lambda: _refresh(stale, start, now, breaker), deadline)
+        except UpstreamBusyError:
+            # The refresh never ran; let the next rerun try again
+            breaker.release()
+            with _cache_lock:
+                _in_flight.difference_update(stale)
+            logger.warning(f"No worker free to fetch corporate actions for {', '.join(stale)}")
+        except TimeoutError:
+            logger.warning(f"Corporate action fetch for {', '.join(stale)} is still running; using cached events")
+        with _cache_lock:
+            cache = _load_cache()
+
+    return {ticker: cache[ticker] for ticker in tickers if ticker in cache}
+
+# --- Applying Events ---
+def apply_actions(holding: Dict, events: Dict, through: str) -> int:
+    """Apply unprocessed splits and dividends to a holding's lots in place
+
+    Each lot remembers the last event date it has seen
+    (``actions_through``), so only newer events are applied and lots
+    added later with older purchase dates still catch up on history.
+    Lots that already need events from before the fetched range
+    (``events["start"]``) are left untouched until a covering fetch
+    lands, so they never move past events they have not seen.
+    Returns the number of lot adjustments made.
+    """
+    splits = sorted(events.get("splits", []))
+    dividends = sorted(events.get("dividends", []))
+    # Oldest first, splits before dividends on the same day
+    timeline = sorted([(d, 0, v) for d, v in splits] + [(d, 1, v) for d, v in dividends])
+    holding.setdefault("dividends", [])
+    holding.setdefault("dividend_income", 0.0)
+
+    applied = 0
+    for lot in holding["purchases"]:
+        processed = lot.get("actions_through", lot["date"])
+        if events.get("start", processed) > processed:
+            continue
+        for date, kind, value in timeline:
+            if date <= processed or date <= lot["date"] or date > through:
+                continue
+            if kind == 0:
+                lot["quantity"] *= value
+                lot["price"] /= value
+            else:
+                # Yahoo reports dividends adjusted for later splits; undo that for the
+                # pre-split share count the lot held on the ex-date
+                later_splits = 1.0
+                for split_date, ratio in splits:
+                    if split_date > date:
+                        later_splits *= ratio
+                amount = lot["quantity"] * value * later_splits
+                holding["dividends"].append({
+                    "date": date,
+                    "lot_date": lot["date"],
+                    "shares": lot["quantity"],
+                    "per_share": value * later_splits,
+                    "amount": amount
+                })
+                holding["dividend_income"] += amount
+            applied += 1
+        lot["actions_through"] = max(processed, through)
+
+    holding["quantity"] = sum(lot["quantity"] for lot in holding["purchases"])
+    return applied
+
+def sync_corporate_actions(portfolio: Dict[str, Dict], today: str = None,
+                           deadline: float = FETCH_DEADLINE) -> Dict[str, int]:
+    """Bring every holding's lots up to date with splits and dividends"""
+    today = today or datetime.now().strftime("%Y-%m-%d")
+    # Lots can be processed up to yesterday at most (see below)
+    yesterday = (datetime.strptime(today, "%Y-%m-%d") - timedelta(days=1)).strftime("%Y-%m-%d")
+    pending = {
+        ticker: holding for ticker, holding in portfolio.items()
+        if any(lot.get("actions_through", lot["date"]) < yesterday for lot in holding.get("purchases", []))
+    }
+    if not pending:
+        return {}
+
+    start = min(lot["date"] for holding in pending.values() for lot in holding["purchases"])
+    actions = get_actions(pending.keys(), start, deadline=deadline)
+
+    applied = {}
+    for ticker, holding in pending.items():
+        if ticker in actions:
+            # Events dated on the fetch day may not be published yet, so stop the day before
+            fetched_day = datetime.fromisoformat(actions[ticker]["fetched_at"]).date()
+            through = min(today, (fetched_day - timedelta(days=1)).strftime("%Y-%m-%d"))
+            count = apply_actions(holding, actions[ticker], through)
+            if count:
+                applied[ticker] = count
+    return applied
@@ -0,0 +1,546 @@
+# Multi-user load test: drive simulated Streamlit sessions against a mock data server
+#
+#   python loadtest.py --sessions 20 --iterations 3 --upstream-latency 50
+#
+# Starts a real `streamlit run app.py` server whose upstream traffic
+# (requests.get calls and yfinance lookups) is redirected to a local mock
+# data server that counts every request. N simulated browser sessions then
+# talk to the app over Streamlit's websocket protocol and walk through the
+# user flows: add stock, open a tile's news, remove the holding.
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlencode, urlparse
+
+import pandas as pd
+import requests
+
+APP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+TICKERS = ["AAPL", "MSFT", "TSLA", "INFY", "GOOGL", "AMZN", "NVDA", "META"]
+HISTORY_DAYS = 400
+
+class AppServerError(RuntimeError):
+    """Raised when the app server under test fails to start or dies mid-run"""
+    pass
+
+# --- Run Directory ---
+def use_workdir(workdir: str):
+    """Keep the app's on-disk caches, server log and counters in ``workdir`` for the run
+
+    The app server subprocess inherits the same directory through the environment.
+    """
+    os.environ["PORTFOLIO_LOADTEST_DIR"] = workdir
+    for name, sub in (("PORTFOLIO_CHART_CACHE", "charts"), ("PORTFOLIO_PRICE_CACHE", "prices"),
+                      ("PORTFOLIO_ACTIONS_CACHE", "actions.json"), ("PORTFOLIO_SNAPSHOT_DIR", "snapshots")):
+        os.environ.setdefault(name, os.path.join(workdir, sub))
+
+def _workdir_path(name: str) -> str:
+    return os.path.join(os.environ["PORTFOLIO_LOADTEST_DIR"], name)
+
+# --- Mock Data Server ---
+def _random_walk(ticker: str, days: int) -> List[float]:
+    seed = int(hashlib.sha1(ticker.encode("utf-8")).hexdigest()[:8], 16)
+    rng = random.Random(seed)
+    price = 50 + seed % 400
+    closes = []
+    for _ in range(days):
+        price *= math.exp(rng.gauss(0.0003, 0.015))
+        closes.append(round(price, 2))
+    return closes
+
+class MockDataHandler(BaseHTTPRequestHandler):
+    """Serves Yahoo-like search, quote/history, news RSS and logo responses"""
+    server_version = "MockData/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, body: bytes, content_type: str = "application/json", status: int = 200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        host = self.headers.get("X-Original-Host", "mock")
+        endpoint = self.server.classify(host, url.path)
+        self.server.record(endpoint)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if endpoint == "search":
+            term = query.get("q", [""])[0].upper()
+            symbol = term if term in TICKERS else TICKERS[hash(term) % len(TICKERS)]
+            self._send(json.dumps({"quotes": [{"symbol": symbol, "quoteType": "EQUITY"}]}).encode())
+        elif endpoint == "quote":
+            ticker = url.path.rsplit("/", 1)[-1]
+            closes = _random_walk(ticker, HISTORY_DAYS)
+            self._send(json.dumps({
+                "shortName": f"{ticker} Inc.", "volume": 1_000_000, "marketCap": 10 ** 11,
+                "trailingPE": 25.0, "dividendYield": 0.01, "fiftyTwoWeekHigh": max(closes[-252:]),
+                "fiftyTwoWeekLow": min(closes[-252:]), "sector": "Technology", "industry": "Software"
+            }).encode())
+        elif endpoint == "history":
+            ticker = url.path.rsplit("/", 1)[-1]
+            days = int(query.get("days", [HISTORY_DAYS])[0])
+            closes = _random_walk(ticker, HISTORY_DAYS)[-days:]
+            dates = pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=len(closes))
+            self._send(json.dumps({"dates": [d.strftime("%Y-%m-%d") for d in dates], "closes": closes}).encode())
+        elif endpoint == "news":
+            items = "".join(
+                f"<item><title>Mock headline {i}</title><link>http://example.com/{i}</link>"
+                f"<description>Mock summary {i}</description><pubDate>Mon, 01 Jan 2024</pubDate></item>"
+                for i in range(8)
+            )
+            self._send(f"<rss><channel>{items}</channel></rss>".encode(), "application/rss+xml")
+        elif endpoint == "logo":
+            self._send(b"\x89PNG\r\n\x1a\n", "image/png")
+        else:
+            self._send(b"{}", status=404)
+
+class MockDataServer(ThreadingHTTPServer):
+    """Local stand-in for every upstream host, with per-endpoint request counts"""
+    daemon_threads = True
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__(("127.0.0.1", 0), MockDataHandler)
+        self.latency = latency
+        self.counts: Counter = Counter()
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    @staticmethod
+    def classify(host: str, path: str) -> str:
+        if path.startswith("/mock/quote"):
+            return "quote"
+        if path.startswith("/mock/history"):
+            return "history"
+        if "search" in path and "finance" in host:
+            return "search"
+        if "news" in host:
+            return "news"
+        if "logo" in host:
+            return "logo"
+        return "other"
+
+    def record(self, endpoint: str):
+        with self._lock:
+            self.counts[endpoint] += 1
+
+    def snapshot(self) -> Counter:
+        with self._lock:
+            return Counter(self.counts)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="mock-data", daemon=True).start()
+
+# --- Upstream Redirection (runs inside the app server process) ---
+def install_upstream_redirect(base: str):
+    """Point requests.get and yfinance at the mock server"""
+    import yfinance as yf
+    real_get = requests.get
+
+    def redirected_get(url, *args, **kwargs):
+        parsed = urlparse(url)
+        headers = dict(kwargs.pop("headers", None) or {})
+        headers["X-Original-Host"] = parsed.netloc
+        local = f"{base}{parsed.path}" + (f"?{parsed.query}" if parsed.query else "")
+        return real_get(local, *args, headers=headers, **kwargs)
+
+    def fetch_json(path: str, **params) -> Dict:
+        response = real_get(f"{base}{path}" + (f"?{urlencode(params)}" if params else ""), timeout=10)
+        response.raise_for_status()
+        return response.json()
+
+    def history_frame(ticker: str, days: int) -> pd.DataFrame:
+        payload = fetch_json(f"/mock/history/{ticker}", days=days)
+        index = pd.DatetimeIndex(pd.to_datetime(payload["dates"]))
+        return pd.DataFrame({"Close": payload["closes"], "Dividends": 0.0, "Stock Splits": 0.0}, index=index)
+
+    class MockTicker:
+        def __init__(self, ticker: str):
+            self.ticker = ticker
+
+        @property
+        def info(self) -> Dict:
+            return fetch_json(f"/mock/quote/{self.ticker}")
+
+        def history(self, period: str = "1mo", **kwargs) -> pd.DataFrame:
+            days = {"1d": 1, "5d": 5, "1mo": 21, "1y": 252}.get(period, HISTORY_DAYS)
+            return history_frame(self.ticker, days)
+
+    def mock_download(tickers, start=None, period=None, **kwargs) -> pd.DataFrame:
+        tickers = [tickers] if isinstance(tickers, str) else list(tickers)
+        days = 1 if period == "1d" else HISTORY_DAYS
+        frames = {ticker: history_frame(ticker, days) for ticker in tickers}
+        frame = pd.concat(frames, axis=1).swaplevel(axis=1).sort_index(axis=1)
+        if start is not None:
+            frame = frame.loc[pd.Timestamp(start):]
+        return frame
+
+    requests.get = redirected_get
+    yf.Ticker = MockTicker
+    yf.download = mock_download
+
+def _publish_fetch_stats(interval: float = 0.25):
+    """Mirror the app's single-flight counters to a file the harness can read"""
+    from singleflight import single_flight
+
+    path = _workdir_path("singleflight.json")
+    while True:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as fh:
+            json.dump(single_flight.stats(), fh)
+        os.replace(tmp_path, path)
+        time.sleep(interval)
+
+def read_fetch_stats() -> Dict[str, Dict[str, int]]:
+    try:
+        with open(_workdir_path("singleflight.json")) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+def serve_app(port: int, mock_url: str):
+    """Run app.py under `streamlit run` with upstream calls redirected"""
+    from streamlit.web import cli
+
+    install_upstream_redirect(mock_url)
+    threading.Thread(target=_publish_fetch_stats, name="fetch-stats", daemon=True).start()
+    sys.argv = [
+        "streamlit", "run", APP_FILE,
+        "--server.port", str(port), "--server.headless", "true",
+        "--server.enableCORS", "false", "--server.enableXsrfProtection", "false",
+        "--server.fileWatcherType", "none", "--browser.gatherUsageStats", "false",
+    ]
+    sys.exit(cli.main())
+
+class AppServer:
+    """The app under test, in its own process"""
+
+    def __init__(self, mock_url: str, port: int):
+        self.port = port
+        self.log_path = _workdir_path("server.log")
+        self._log = open(self.log_path, "w")
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--serve-app", str(port), "--mock-url", mock_url],
+            stdout=self._log, stderr=subprocess.STDOUT
+        )
+
+    def wait_ready(self, timeout: float = 60.0):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise AppServerError("App server exited during startup")
+            try:
+                if requests.get(f"http://127.0.0.1:{self.port}/_stcore/health", timeout=1).ok:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.25)
+        raise AppServerError(f"App server did not start within {timeout:.0f}s")
+
+    def rss_bytes(self) -> int:
+        with open(f"/proc/{self.process.pid}/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self._log.close()
+
+# --- Simulated Sessions ---
+class SimulatedSession:
+    """One browser tab speaking Streamlit's websocket protocol"""
+
+    def __init__(self, session_id: int, port: int, timeout: float):
+        self.session_id = session_id
+        self.url = f"ws://127.0.0.1:{port}/_stcore/stream"
+        self.timeout = timeout
+        self.ws = None
+        self.widgets: List = []
+        self.timings: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Counter = Counter()
+        self.error_log: List[str] = []
+
+    async def connect(self):
+        from websockets.asyncio.client import connect
+        self.ws = await connect(self.url, subprotocols=["streamlit"], max_size=None, open_timeout=self.timeout)
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+
+    async def _rerun(self, widget_states: List) -> List[str]:
+        """Trigger a script run and wait for it (and any st.rerun) to finish"""
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        msg = BackMsg()
+        msg.rerun_script.query_string = ""
+        msg.rerun_script.page_script_hash = ""
+        msg.rerun_script.widget_states.widgets.extend(widget_states)
+        await self.ws.send(msg.SerializeToString())
+
+        exceptions = []
+        while True:
+            raw = await asyncio.wait_for(self.ws.recv(), self.timeout)
+            fwd = ForwardMsg()
+            fwd.ParseFromString(raw)
+            kind = fwd.WhichOneof("type")
+            if kind == "new_session":
+                self.widgets = []
+                exceptions = []
+            elif kind == "delta" and fwd.delta.WhichOneof("type") == "new_element":
+                element = fwd.delta.new_element
+                element_type = element.WhichOneof("type")
+                if element_type == "exception":
+                    exceptions.append(element.exception.message)
+                elif element_type in ("button", "text_input", "selectbox"):
+                    self.widgets.append(getattr(element, element_type))
+            elif kind == "script_finished":
+                if fwd.script_finished in (ForwardMsg.FINISHED_SUCCESSFULLY, ForwardMsg.FINISHED_WITH_COMPILE_ERROR):
+                    return exceptions
+
+    def _widget_id(self, label: str = None, key: str = None) -> str:
+        for widget in self.widgets:
+            if (key and widget.id.endswith(f"-{key}")) or (label and widget.label == label):
+                return widget.id
+        raise LookupError(f"No widget {key or label!r} on the page")
+
+    async def _timed(self, flow: str, build_states):
+        started = time.perf_counter()
+        try:
+            exceptions = await self._rerun(build_states())
+            if exceptions:
+                self.errors[flow] += 1
+                self.error_log.append(f"{flow}: {exceptions[0]}")
+        except Exception as e:
+            self.errors[flow] += 1
+            self.error_log.append(f"{flow}: {type(e).__name__}: {e}")
+        self.timings[flow].append(time.perf_counter() - started)
+
+    @staticmethod
+    def _state(widget_id: str, **value):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+        return WidgetState(id=widget_id, **value)
+
+    async def open(self):
+        await self.connect()
+        await self._timed("open", lambda: [])
+
+    async def add_stock(self, ticker: str):
+        await self._timed("add_stock", lambda: [
+            self._state(self._widget_id(key="company_search"), string_value=ticker),
+            self._state(self._widget_id(label="🎬 ADD TO PORTFOLIO"), trigger_value=True),
+        ])
+
+    async def select_tile(self, ticker: str):
+        await self._timed("select_tile", lambda: [
+            self._state(self._widget_id(key=f"select_{ticker}"), trigger_value=True),
+        ])
+
+    async def remove_holding(self, ticker: str):
+        await self._timed("remove_holding", lambda: [
+            self._state(self._widget_id(label="Select stock to remove"), string_value=ticker),
+            self._state(self._widget_id(label="Remove Stock"), trigger_value=True),
+        ])
+
+    async def run_scenario(self, iterations: int, holdings: int):
+        rng = random.Random(self.session_id)
+        await self.open()
+        for _ in range(iterations):
+            picks = rng.sample(TICKERS, holdings)
+            for ticker in picks:
+                await self.add_stock(ticker)
+            await self.select_tile(picks[0])
+            for ticker in picks:
+                await self.remove_holding(ticker)
+
+# --- Reporting ---
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    pos = min(int(math.ceil(pct / 100 * len(ordered))) - 1, len(ordered) - 1)
+    return ordered[max(pos, 0)]
+
+async def profile_flows(mock: MockDataServer, port: int, timeout: float) -> Dict[str, Dict[str, int]]:
+    """Upstream requests caused by each flow for one session on its own"""
+    session = SimulatedSession(-1, port, timeout)
+    steps = [
+        ("open", session.open),
+        ("add_stock", lambda: session.add_stock("AAPL")),
+        ("add_stock", lambda: session.add_stock("MSFT")),
+        ("select_tile", lambda: session.select_tile("AAPL")),
+        ("remove_holding", lambda: session.remove_holding("AAPL")),
+        ("remove_holding", lambda: session.remove_holding("MSFT")),
+    ]
+    profile: Dict[str, Dict[str, int]] = {}
+    for flow, step in steps:
+        before = mock.snapshot()
+        await step()
+        profile.setdefault(flow, dict(mock.snapshot() - before))
+    await session.close()
+    return profile
+
+async def _drive(sessions: List[SimulatedSession], iterations: int, holdings: int, server: AppServer) -> int:
+    """Run every session concurrently while sampling peak server memory"""
+    peak = server.rss_bytes()
+    tasks = [asyncio.create_task(s.run_scenario(iterations, holdings)) for s in sessions]
+    while not all(task.done() for task in tasks):
+        peak = max(peak, server.rss_bytes())
+        await asyncio.sleep(0.2)
+    await asyncio.gather(*tasks)
+    return max(peak, server.rss_bytes())
+
+async def _run(args) -> Dict:
+    mock = MockDataServer(args.upstream_latency / 1000)
+    mock.start()
+    server = AppServer(mock.base_url, args.port)
+    try:
+        server.wait_ready()
+        profile = await profile_flows(mock, args.port, args.timeout)
+
+        rss_before = server.rss_bytes()
+        before = mock.snapshot()
+        fetch_before = read_fetch_stats()
+        sessions = [SimulatedSession(i, args.port, args.timeout) for i in range(args.sessions)]
+        started = time.perf_counter()
+        rss_peak = await _drive(sessions, args.iterations, min(args.holdings, len(TICKERS)), server)
+        elapsed = time.perf_counter() - started
+        # Sessions are still connected, so their server-side state is still resident
+        if server.process.poll() is not None:
+            raise AppServerError("App server exited during the run")
+        rss_after = server.rss_bytes()
+        upstream = mock.snapshot() - before
+        time.sleep(0.5)  # let the server publish its final counters
+        fetch_after = read_fetch_stats()
+        await asyncio.gather(*(s.close() for s in sessions))
+    finally:
+        server.stop()
+        mock.shutdown()
+
+    flows: Dict[str, List[float]] = defaultdict(list)
+    errors: Counter = Counter()
+    error_samples = []
+    for session in sessions:
+        for flow, timings in session.timings.items():
+            flows[flow].extend(timings)
+        errors.update(session.errors)
+        error_samples.extend(session.error_log[:1])
+
+    actions = sum(len(timings) for timings in flows.values())
+    return {
+        "sessions": args.sessions,
+        "actions": actions,
+        "elapsed_s": elapsed,
+        "throughput_actions_per_s": actions / elapsed if elapsed > 0 else 0.0,
+        "latency_s": {
+            flow: {
+                "count": len(timings),
+                "p50": _percentile(timings, 50),
+                "p95": _percentile(timings, 95),
+                "p99": _percentile(timings, 99),
+                "max": max(timings),
+                "mean": statistics.fmean(timings),
+            }
+            for flow, timings in sorted(flows.items())
+        },
+        "errors": dict(errors),
+        "error_samples": error_samples[:5],
+        "upstream_requests": dict(upstream),
+        "upstream_per_action": sum(upstream.values()) / actions if actions else 0.0,
+        "upstream_per_flow_single_session": profile,
+        "single_flight": {
+            endpoint: {name: count - fetch_before.get(endpoint, {}).get(name, 0) for name, count in counts.items()}
+            for endpoint, counts in fetch_after.items()
+        },
+        "rss_baseline_mb": rss_before / 2 ** 20,
+        "rss_peak_mb": rss_peak / 2 ** 20,
+        "rss_per_session_mb": (rss_after - rss_before) / args.sessions / 2 ** 20,
+        "rss_peak_per_session_mb": (rss_peak - rss_before) / args.sessions / 2 ** 20,
+    }
+
+def print_report(report: Dict):
+    print(f"\nSessions: {report['sessions']}  Actions: {report['actions']}  "
+          f"Elapsed: {report['elapsed_s']:.1f}s  Throughput: {report['throughput_actions_per_s']:.2f} actions/s")
+    print(f"\n{'Flow':<16}{'count':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for flow, stats in report["latency_s"].items():
+        print(f"{flow:<16}{stats['count']:>7}{stats['p50']:>9.3f}{stats['p95']:>9.3f}{stats['p99']:>9.3f}{stats['max']:>9.3f}")
+    if report["errors"]:
+        print(f"\nErrors: {report['errors']}")
+        for sample in report["error_samples"]:
+            print(f"  e.g. {sample}")
+    print(f"\nUpstream requests: {report['upstream_requests']}")
+    print(f"Upstream requests per user action: {report['upstream_per_action']:.2f}")
+    print("Upstream requests per flow (single session):")
+    for flow, counts in report["upstream_per_flow_single_session"].items():
+        print(f"  {flow:<16}{sum(counts.values()):>4}  {counts}")
+    if report["single_flight"]:
+        print("Single-flight (calls / fetched / collapsed / timeouts / errors):")
+        for endpoint, counts in report["single_flight"].items():
+            print(f"  {endpoint:<8}{counts['calls']:>6}{counts['executed']:>6}{counts['collapsed']:>6}"
+                  f"{counts['timeouts']:>6}{counts['errors']:>6}")
+    print(f"\nServer RSS: {report['rss_baseline_mb']:.1f} MB baseline, {report['rss_peak_mb']:.1f} MB peak, "
+          f"{report['rss_per_session_mb']:.2f} MB per session at end ({report['rss_peak_per_session_mb']:.2f} MB at peak)")
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Load-test app.py with simulated concurrent sessions")
+    parser.add_argument("--sessions", type=int, default=10, help="concurrent simulated sessions")
+    parser.add_argument("--iterations", type=int, default=2, help="scenario repetitions per session")
+    parser.add_argument("--holdings", type=int, default=3, help="stocks added per scenario")
+    parser.add_argument("--upstream-latency", type=float, default=20.0, help="mock upstream latency in ms")
+    parser.add_argument("--timeout", type=float, default=60.0, help="per-action timeout in seconds")
+    parser.add_argument("--port", type=int, default=8599, help="port for the app server under test")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--serve-app", type=int, metavar="PORT", help=argparse.SUPPRESS)
+    parser.add_argument("--mock-url", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve_app:
+        return serve_app(args.serve_app, args.mock_url)
+
+    workdir = tempfile.mkdtemp(prefix="portfolio-loadtest-")
+    use_workdir(workdir)
+    keep_workdir = False
+    try:
+        report = asyncio.run(_run(args))
+    except AppServerError as e:
+        # Keep the run directory so the server log can be read
+        keep_workdir = True
+        print(f"{e}; server log: {_workdir_path('server.log')}", file=sys.stderr)
+        return 1
+    finally:
+        if not keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(report, fh, indent=2)
+
+if __name__ == "__main__":
+    sys.exit(main())
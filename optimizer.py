@@ -0,0 +1,305 @@
+# Portfolio optimizer and rebalancing-trade generator
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# --- Optimizer Settings ---
+TRADING_DAYS = 252
+DEFAULT_LOOKBACK = 756          # ~3 years of daily returns
+MAX_ITERATIONS = 500
+TOLERANCE = 1e-8
+SHORT_TERM_TAX_RATE = 0.20
+LONG_TERM_TAX_RATE = 0.125
+LONG_TERM_DAYS = 365
+
+class OptimizationError(Exception):
+    """Raised when no portfolio satisfies the requested constraints"""
+    pass
+
+# --- Covariance Estimates ---
+def ledoit_wolf(returns: np.ndarray) -> np.ndarray:
+    """Shrink the sample covariance toward a scaled identity (Ledoit-Wolf)"""
+    n_obs, n_assets = returns.shape
+    centered = returns - returns.mean(axis=0)
+    sample = centered.T @ centered / n_obs
+    mu = np.trace(sample) / n_assets
+    target = mu * np.eye(n_assets)
+
+    delta = np.sum((sample - target) ** 2) / n_assets
+    squared = centered ** 2
+    beta = np.sum(squared.T @ squared / n_obs - sample ** 2) / (n_assets * n_obs)
+    shrinkage = min(beta, delta) / delta if delta > 0 else 1.0
+    return shrinkage * target + (1 - shrinkage) * sample
+
+class CovarianceCache:
+    """Process-wide cache of annualized return/covariance estimates
+
+    Entries are keyed by the price data version, so a new optimization
+    on unchanged data (or on a subset of its tickers) slices a cached
+    matrix instead of re-estimating it.
+    """
+
+    def __init__(self, max_items: int = 32):
+        self.max_items = max_items
+        self._items: "OrderedDict[Tuple, Tuple[List[str], np.ndarray, np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _version(prices: pd.DataFrame, lookback: int) -> Tuple:
+        return (len(prices), str(prices.index[-1]), lookback)
+
+    def estimate(self, prices: pd.DataFrame, tickers: Sequence[str], lookback: int = DEFAULT_LOOKBACK) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (expected returns, covariance) for ``tickers``"""
+        version = self._version(prices, lookback)
+        wanted = list(tickers)
+
+        with self._lock:
+            for key, (columns, mu, cov) in reversed(self._items.items()):
+                if key[1:] == version and set(wanted) <= set(columns):
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    pos = [columns.index(t) for t in wanted]
+                    return mu[pos], cov[np.ix_(pos, pos)]
+            self.misses += 1
+
+        columns = sorted(set(prices.columns) & set(wanted))
+        if len(columns) != len(set(wanted)):
+            missing = sorted(set(wanted) - set(columns))
+            raise OptimizationError(f"No price history for {', '.join(missing)}")
+
+        returns = prices[columns].iloc[-(lookback + 1):].pct_change().iloc[1:]
+        returns = returns.dropna(how="all").fillna(0.0).to_numpy(dtype=float)
+        if len(returns) < 20:
+            raise OptimizationError("Not enough price history to estimate risk")
+
+        mu = returns.mean(axis=0) * TRADING_DAYS
+        cov = ledoit_wolf(returns) * TRADING_DAYS
+
+        with self._lock:
+            self._items[(tuple(columns),) + version] = (columns, mu, cov)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+        pos = [columns.index(t) for t in wanted]
+        return mu[pos], cov[np.ix_(pos, pos)]
+
+# Shared by every session in this server process
+covariance_cache = CovarianceCache()
+
+# --- Constraint Projection ---
+def _bisect(fn, lo: np.ndarray, hi: np.ndarray, target, iterations: int = 60) -> np.ndarray:
+    """Vectorized bisection for decreasing ``fn`` so that fn(x) == target"""
+    for _ in range(iterations):
+        mid = (lo + hi) / 2
+        above = fn(mid) > target
+        lo = np.where(above, mid, lo)
+        hi = np.where(above, hi, mid)
+    return (lo + hi) / 2
+
+def project_weights(v: np.ndarray, max_weight: float = 1.0, sectors: Optional[np.ndarray] = None,
+                    sector_caps: Optional[np.ndarray] = None) -> np.ndarray:
+    """Euclidean projection onto {sum w = 1, 0 <= w <= max_weight, sector sums <= caps}
+
+    ``sectors`` holds an integer sector id per asset and ``sector_caps``
+    the cap per id. Sectors are disjoint, so for a global threshold each
+    sector contributes min(cap, its clipped sum); one bisection finds the
+    global threshold and a second, run for all capped sectors at once,
+    finds their individual thresholds.
+    """
+    n = len(v)
+    if sectors is None:
+        sectors = np.zeros(n, dtype=np.int64)
+        sector_caps = np.array([1.0])
+    n_sectors = len(sector_caps)
+
+    capacity = np.minimum(sector_caps, np.bincount(sectors, minlength=n_sectors) * max_weight)
+    if capacity.sum() < 1 - 1e-9:
+        raise OptimizationError("Position and sector caps leave less than 100% to allocate")
+
+    def sector_sums(tau):
+        return np.bincount(sectors, weights=np.clip(v - tau, 0.0, max_weight), minlength=n_sectors)
+
+    def total(tau):
+        return np.minimum(sector_sums(tau), sector_caps).sum()
+
+    lo, hi = np.array(v.min() - max_weight), np.array(v.max())
+    tau = float(_bisect(total, lo, hi, 1.0))
+
+    thresholds = np.full(n_sectors, tau)
+    over = sector_sums(tau) > sector_caps
+    if over.any():
+        # Raise the threshold of each over-cap sector until it sits exactly at its cap
+        def per_sector(t):
+            return np.bincount(sectors, weights=np.clip(v - t[sectors], 0.0, max_weight), minlength=n_sectors)
+        hi_s = np.full(n_sectors, float(v.max()))
+        solved = _bisect(per_sector, np.full(n_sectors, tau), hi_s, sector_caps)
+        thresholds = np.where(over, solved, tau)
+
+    return np.clip(v - thresholds[sectors], 0.0, max_weight)
+
+# --- Optimizers ---
+def _constraint_arrays(tickers: Sequence[str], sector_of: Optional[Dict[str, str]],
+                       sector_cap: Optional[float]) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+    if not sector_of or sector_cap is None or sector_cap >= 1:
+        return None, None
+    names = sorted({sector_of.get(t, "Unknown") for t in tickers})
+    ids = np.array([names.index(sector_of.get(t, "Unknown")) for t in tickers])
+    return ids, np.full(len(names), float(sector_cap))
+
+def mean_variance(mu: np.ndarray, cov: np.ndarray, risk_aversion: float = 3.0, max_weight: float = 1.0,
+                  sectors: Optional[np.ndarray] = None, sector_caps: Optional[np.ndarray] = None) -> np.ndarray:
+    """Maximize mu'w - risk_aversion/2 w'Cw with accelerated projected gradient"""
+    n = len(mu)
+    step = 1.0 / (risk_aversion * np.linalg.eigvalsh(cov)[-1] + 1e-12)
+    project = lambda x: project_weights(x, max_weight, sectors, sector_caps)
+
+    w = project(np.full(n, 1.0 / n))
+    y, t = w, 1.0
+    for _ in range(MAX_ITERATIONS):
+        w_next = project(y - step * (risk_aversion * cov @ y - mu))
+        if np.abs(w_next - w).max() < TOLERANCE:
+            w = w_next
+            break
+        t_next = (1 + np.sqrt(1 + 4 * t * t)) / 2
+        y = w_next + ((t - 1) / t_next) * (w_next - w)
+        w, t = w_next, t_next
+    return w
+
+def risk_parity(cov: np.ndarray, budgets: Optional[np.ndarray] = None, max_weight: float = 1.0,
+                sectors: Optional[np.ndarray] = None, sector_caps: Optional[np.ndarray] = None) -> np.ndarray:
+    """Equal (or budgeted) risk contributions via cyclical coordinate descent"""
+    n = len(cov)
+    budgets = np.full(n, 1.0 / n) if budgets is None else budgets / budgets.sum()
+    diag = np.diag(cov)
+    y = 1.0 / np.sqrt(diag)
+    cy = cov @ y
+
+    for _ in range(MAX_ITERATIONS):
+        previous = y.copy()
+        for i in range(n):
+            off = cy[i] - diag[i] * y[i]
+            new = (-off + np.sqrt(off * off + 4 * diag[i] * budgets[i])) / (2 * diag[i])
+            cy += cov[:, i] * (new - y[i])
+            y[i] = new
+        if np.abs(y - previous).max() < TOLERANCE * y.max():
+            break
+
+    w = y / y.sum()
+    if max_weight < 1 or sectors is not None:
+        # Caps are applied as the nearest feasible portfolio to the unconstrained solution
+        w = project_weights(w, max_weight, sectors, sector_caps)
+    return w
+
+def optimize_portfolio(prices: pd.DataFrame, tickers: Sequence[str], method: str = "mean_variance",
+                       risk_aversion: float = 3.0, max_weight: float = 1.0,
+                       sector_of: Optional[Dict[str, str]] = None, sector_cap: Optional[float] = None,
+                       lookback: int = DEFAULT_LOOKBACK) -> Dict[str, float]:
+    """Propose target weights with methods mean_variance, min_variance or risk_parity"""
+    tickers = list(tickers)
+    if not tickers:
+        raise OptimizationError("No holdings to optimize")
+    if max_weight * len(tickers) < 1 - 1e-9:
+        raise OptimizationError(f"A {max_weight:.0%} position cap needs at least {int(np.ceil(1 / max_weight))} holdings")
+
+    mu, cov = covariance_cache.estimate(prices, tickers, lookback)
+    sectors, sector_caps = _constraint_arrays(tickers, sector_of, sector_cap)
+
+    if method == "risk_parity":
+        w = risk_parity(cov, max_weight=max_weight, sectors=sectors, sector_caps=sector_caps)
+    elif method == "min_variance":
+        w = mean_variance(np.zeros(len(tickers)), cov, 1.0, max_weight, sectors, sector_caps)
+    elif method == "mean_variance":
+        w = mean_variance(mu, cov, risk_aversion, max_weight, sectors, sector_caps)
+    else:
+        raise OptimizationError(f"Unknown optimization method '{method}'")
+
+    return {ticker: float(weight) for ticker, weight in zip(tickers, w)}
+
+# --- Trade Generation ---
+def _lot_tax(lot: Dict, price: float, today: datetime) -> float:
+    """Estimated tax per share for selling from a lot at ``price``"""
+    gain = price - lot["price"]
+    held_days = (today - datetime.strptime(lot["date"], "%Y-%m-%d")).days
+    rate = LONG_TERM_TAX_RATE if held_days > LONG_TERM_DAYS else SHORT_TERM_TAX_RATE
+    return gain * rate
+
+def select_lots(purchases: List[Dict], quantity: float, price: float, today: Optional[datetime] = None) -> List[Dict]:
+    """Pick lots to sell, lowest estimated tax per share first (losses before gains)"""
+    today = today or datetime.now()
+    ranked = sorted(purchases, key=lambda lot: _lot_tax(lot, price, today))
+    remaining = quantity
+    chosen = []
+    for lot in ranked:
+        if remaining <= 0:
+            break
+        take = min(lot["quantity"], remaining)
+        chosen.append({
+            "date": lot["date"],
+            "quantity": take,
+            "cost": lot["price"],
+            "gain": (price - lot["price"]) * take,
+            "tax": _lot_tax(lot, price, today) * take
+        })
+        remaining -= take
+    return chosen
+
+def generate_trades(portfolio: Dict[str, Dict], prices: Dict[str, float], target_weights: Dict[str, float],
+                    cash: float = 0.0, band: float = 0.02, min_trade_value: float = 0.0,
+                    fractional: bool = False) -> List[Dict]:
+    """Smallest set of trades that moves holdings to the target weights
+
+    Positions already within ``band`` of their target are left alone,
+    sells draw on the most tax-efficient lots, and buys are scaled down
+    if sale proceeds plus cash cannot fund them.
+    """
+    quantities = {t: float(portfolio[t]["quantity"]) if t in portfolio else 0.0 for t in target_weights}
+    total_value = sum(quantities[t] * prices[t] for t in target_weights) + cash
+    if total_value <= 0:
+        raise OptimizationError("Portfolio has no value to rebalance")
+
+    sells, buys = [], []
+    for ticker, weight in target_weights.items():
+        price = prices[ticker]
+        current_weight = quantities[ticker] * price / total_value
+        if abs(weight - current_weight) < band:
+            continue
+
+        shares = (weight - current_weight) * total_value / price
+        shares = shares if fractional else float(np.trunc(shares))
+        if shares == 0 or abs(shares) * price < min_trade_value:
+            continue
+
+        trade = {"ticker": ticker, "quantity": abs(shares), "price": price, "value": abs(shares) * price}
+        if shares < 0:
+            lots = select_lots(portfolio[ticker]["purchases"], abs(shares), price)
+            trade.update({
+                "action": "SELL",
+                "lots": lots,
+                "realized_gain": sum(lot["gain"] for lot in lots),
+                "estimated_tax": sum(lot["tax"] for lot in lots)
+            })
+            sells.append(trade)
+        else:
+            trade.update({"action": "BUY", "lots": [], "realized_gain": 0.0, "estimated_tax": 0.0})
+            buys.append(trade)
+
+    available = cash + sum(trade["value"] for trade in sells)
+    needed = sum(trade["value"] for trade in buys)
+    if needed > available:
+        scale = available / needed
+        for trade in buys:
+            shares = trade["quantity"] * scale
+            trade["quantity"] = shares if fractional else float(np.floor(shares))
+            trade["value"] = trade["quantity"] * trade["price"]
+        buys = [trade for trade in buys if trade["quantity"] > 0]
+
+    return sells + buys
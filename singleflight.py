@@ -0,0 +1,110 @@
+# Process-wide deduplication of concurrent upstream fetches (single-flight)
+import contextvars
+import copy
+import functools
+import logging
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+# --- Single-Flight Settings ---
+DEFAULT_TIMEOUT = 30.0   # seconds a caller waits on a shared fetch
+
+class _Flight:
+    """One in-flight upstream call and the callers waiting on it"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 1
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key onto one execution
+
+    The first caller for a key starts the fetch on its own thread; every
+    caller, including the first, then waits for it with its own timeout.
+    A caller that times out gives up alone and the fetch carries on for
+    the others. Errors are re-raised to every caller that was waiting.
+    Finished results are not kept, so later calls fetch again.
+    """
+
+    def __init__(self):
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Counter] = {}
+
+    def _count(self, endpoint: str, name: str):
+        # Called with self._lock held
+        self._counters.setdefault(endpoint, Counter())[name] += 1
+
+    def _execute(self, endpoint: str, key: Hashable, flight: _Flight, fn: Callable[[], Any]):
+        try:
+            flight.value = fn()
+        except BaseException as e:
+            flight.error = e
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+                if flight.error is not None:
+                    self._count(endpoint, "errors")
+            flight.done.set()
+
+    def do(self, endpoint: str, key: Hashable, fn: Callable[[], Any], timeout: Optional[float] = DEFAULT_TIMEOUT) -> Any:
+        """Return ``fn()``, sharing the result with concurrent callers of the same key"""
+        flight_key = (endpoint, key)
+        with self._lock:
+            self._count(endpoint, "calls")
+            flight = self._flights.get(flight_key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[flight_key] = flight
+                self._count(endpoint, "executed")
+            else:
+                flight.waiters += 1
+                self._count(endpoint, "collapsed")
+
+        if leader:
+            # The fetch runs with the first caller's context variables
+            context = contextvars.copy_context()
+            threading.Thread(
+                target=context.run, args=(self._execute, endpoint, flight_key, flight, fn),
+                name=f"singleflight-{endpoint}", daemon=True
+            ).start()
+
+        if not flight.done.wait(timeout):
+            with self._lock:
+                self._count(endpoint, "timeouts")
+            raise TimeoutError(f"{endpoint} fetch for {key} still running after {timeout:.1f}s")
+        if flight.error is not None:
+            raise flight.error
+        # Callers may mutate what they get back, so only the first keeps the original
+        return flight.value if leader else copy.deepcopy(flight.value)
+
+    def shared(self, endpoint: str, timeout: Optional[float] = DEFAULT_TIMEOUT):
+        """Decorator: dedupe calls to a fetch function by endpoint and arguments"""
+        def decorator(fn: Callable) -> Callable:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                key = (args, tuple(sorted(kwargs.items())))
+                return self.do(endpoint, key, lambda: fn(*args, **kwargs), timeout)
+            return wrapper
+        return decorator
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._flights)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Per-endpoint counts of calls, executed fetches, collapsed calls, timeouts and errors"""
+        names = ("calls", "executed", "collapsed", "timeouts", "errors")
+        with self._lock:
+            return {
+                endpoint: {name: counts[name] for name in names}
+                for endpoint, counts in sorted(self._counters.items())
+            }
+
+single_flight = SingleFlight()
@@ -0,0 +1,266 @@
+# Last-known-good snapshots, circuit breakers and deadlines for upstream calls
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# --- Resilience Settings ---
+SNAPSHOT_DIR = os.environ.get("PORTFOLIO_SNAPSHOT_DIR", ".snapshots")
+REPLAY_MODE = os.environ.get("PORTFOLIO_REPLAY", "").lower() in ("1", "true", "yes")
+DEFAULT_DEADLINE = 4.0        # seconds a page waits on an upstream call
+FAILURE_THRESHOLD = 3         # consecutive failures before a host's breaker opens
+RESET_TIMEOUT = 30.0          # seconds before an open breaker lets a trial call through
+UPSTREAM_WORKERS = 16
+
+class UpstreamUnavailableError(Exception):
+    """Raised when an upstream call fails and no snapshot can stand in"""
+    pass
+
+class CircuitOpenError(UpstreamUnavailableError):
+    """Raised when a host's circuit breaker is rejecting calls"""
+    pass
+
+class UpstreamBusyError(TimeoutError):
+    """Raised when no upstream worker picked a call up before its deadline"""
+    pass
+
+# --- Snapshot Store ---
+def _json_default(value):
+    if hasattr(value, "item"):
+        return value.item()
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    raise TypeError(f"Cannot snapshot value of type {type(value).__name__}")
+
+class SnapshotStore:
+    """Last-known-good values per (kind, key), kept in memory and on disk"""
+
+    def __init__(self, root: Optional[str] = SNAPSHOT_DIR):
+        self.root = root
+        self._items: Dict[Tuple[str, str], Dict] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, kind: str, key: str) -> Optional[str]:
+        if not self.root:
+            return None
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.root, kind, f"{digest}.json")
+
+    def save(self, kind: str, key: str, value: Any):
+        """Record a fresh value"""
+        record = {"key": key, "saved_at": time.time(), "value": value}
+        with self._lock:
+            self._items[(kind, key)] = record
+
+        path = self._path(kind, key)
+        if not path:
+            return
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w") as fh:
+                json.dump(record, fh, default=_json_default)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError) as e:
+            logger.warning(f"Failed to write {kind} snapshot for {key}: {str(e)}")
+
+    def load(self, kind: str, key: str) -> Optional[Dict]:
+        """Return {"value", "saved_at"} for the last recorded value, if any"""
+        with self._lock:
+            record = self._items.get((kind, key))
+        if record is not None:
+            return record
+
+        path = self._path(kind, key)
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path) as fh:
+                record = json.load(fh)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable {kind} snapshot for {key}: {str(e)}")
+            return None
+        with self._lock:
+            self._items[(kind, key)] = record
+        return record
+
+# --- Circuit Breakers ---
+class CircuitBreaker:
+    """Stop calling a host after repeated failures, then probe it periodically"""
+
+    def __init__(self, host: str, failure_threshold: int = FAILURE_THRESHOLD, reset_timeout: float = RESET_TIMEOUT):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.time() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        """Whether a call may go out now (one trial call when half-open)"""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def release(self):
+        """Give back a half-open trial slot for a call that never went out"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning(f"Circuit opened for {self.host} after {self.failures} failures")
+                self.opened_at = time.time()
+            self._trial_in_flight = False
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+def upstream_host(url_or_host: str) -> str:
+    """Breaker key for a URL or host: its last three labels
+
+    query1/query2.finance.yahoo.com and finance.yahoo.com all share one
+    breaker, and news.google.com keeps its own.
+    """
+    host = urlparse(url_or_host).netloc if "//" in url_or_host else url_or_host
+    return ".".join(host.split(":")[0].lower().split(".")[-3:])
+
+def breaker_for(host: str) -> CircuitBreaker:
+    """Process-wide breaker for an upstream host (or URL)"""
+    host = upstream_host(host)
+    with _breakers_lock:
+        if host not in _breakers:
+            _breakers[host] = CircuitBreaker(host)
+        return _breakers[host]
+
+def breaker_states() -> Dict[str, str]:
+    with _breakers_lock:
+        return {host: breaker.state for host, breaker in _breakers.items()}
+
+# --- Resilient Calls ---
+snapshot_store = SnapshotStore()
+_executor = ThreadPoolExecutor(max_workers=UPSTREAM_WORKERS, thread_name_prefix="upstream")
+# Set while resilient_call is running a fetch, which then owns the breaker for it
+_in_resilient_call = contextvars.ContextVar("in_resilient_call", default=False)
+
+def in_resilient_call() -> bool:
+    """Whether the current fetch runs under resilient_call (so must not touch breakers itself)"""
+    return _in_resilient_call.get()
+
+def _owned_by_resilient_call(fn: Callable[[], Any]) -> Callable[[], Any]:
+    def run():
+        _in_resilient_call.set(True)
+        return fn()
+    # Each executor task runs in a fresh context, so the flag never leaks to other tasks
+    return lambda: contextvars.Context().run(run)
+
+def call_with_deadline(fn: Callable[[], Any], deadline: float) -> Any:
+    """Run ``fn`` but stop waiting for it after ``deadline`` seconds of running
+
+    The deadline is timed from when a worker starts the call, so time spent
+    queued behind other calls is not blamed on the upstream. A call still
+    queued after ``deadline`` is cancelled and raises UpstreamBusyError.
+    """
+    started = threading.Event()
+    started_at = [0.0]
+
+    def run():
+        started_at[0] = time.monotonic()
+        started.set()
+        return fn()
+
+    future = _executor.submit(run)
+    if not started.wait(deadline) and future.cancel():
+        raise UpstreamBusyError(f"No upstream worker free within {deadline:.1f}s")
+    started.wait()
+    remaining = max(started_at[0] + deadline - time.monotonic(), 0.0)
+    try:
+        return future.result(timeout=remaining)
+    except FutureTimeoutError:
+        raise TimeoutError(f"Upstream call exceeded {deadline:.1f}s deadline")
+
+def resilient_call(kind: str, key: str, host: str, fn: Callable[[], Any],
+                   deadline: float = DEFAULT_DEADLINE, replay: bool = REPLAY_MODE) -> Tuple[Any, Dict]:
+    """Call upstream, falling back to the last-known-good snapshot
+
+    Returns ``(value, meta)`` where meta has ``stale`` (bool),
+    ``saved_at`` (epoch seconds of the value) and, when stale,
+    ``reason``. Raises UpstreamUnavailableError when the call fails and
+    there is no snapshot to serve.
+    """
+    if replay:
+        record = snapshot_store.load(kind, key)
+        if record is None:
+            raise UpstreamUnavailableError(f"No recorded {kind} snapshot for {key}")
+        return record["value"], {"stale": True, "saved_at": record["saved_at"], "reason": "replay"}
+
+    breaker = breaker_for(host)
+    if breaker.allow():
+        try:
+            value = call_with_deadline(_owned_by_resilient_call(fn), deadline)
+            breaker.record_success()
+            snapshot_store.save(kind, key, value)
+            return value, {"stale": False, "saved_at": time.time()}
+        except UpstreamBusyError as e:
+            # Never reached the host, so it says nothing about the host's health
+            breaker.release()
+            reason = str(e)
+            logger.warning(f"{kind} fetch for {key} not started, trying snapshot: {reason}")
+            error = e
+        except Exception as e:
+            breaker.record_failure()
+            reason = str(e)
+            logger.warning(f"{kind} fetch for {key} failed, trying snapshot: {reason}")
+            error: Exception = e
+    else:
+        reason = f"{host} circuit open"
+        error = CircuitOpenError(reason)
+
+    record = snapshot_store.load(kind, key)
+    if record is None:
+        raise UpstreamUnavailableError(f"{kind} for {key} unavailable: {error}") from error
+    return record["value"], {"stale": True, "saved_at": record["saved_at"], "reason": reason}
+
+def describe_staleness(meta: Dict) -> str:
+    """Short human label such as 'as of 14:05 (3 min old)'"""
+    age = max(time.time() - meta["saved_at"], 0)
+    if age < 3600:
+        ago = f"{int(age // 60)} min old"
+    elif age < 86400:
+        ago = f"{int(age // 3600)} h old"
+    else:
+        ago = f"{int(age // 86400)} d old"
+    stamp = time.strftime("%H:%M" if age < 86400 else "%Y-%m-%d", time.localtime(meta["saved_at"]))
+    return f"as of {stamp} ({ago})"
@@ -0,0 +1,268 @@
+# Live price streaming: one upstream subscriber feeding a shared price bus
+import csv
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+import yfinance as yf
+
+logger = logging.getLogger(__name__)
+
+# --- Streaming Settings ---
+POLL_INTERVAL = 5.0          # seconds between batched upstream polls
+WATCH_EXPIRY = 120.0         # drop tickers no session has asked for in this long
+STREAM_MODE = os.environ.get("PORTFOLIO_STREAM_MODE", "auto")  # auto | websocket | poll | replay
+STREAM_URL = os.environ.get("PORTFOLIO_STREAM_URL")
+REPLAY_FILE = os.environ.get("PORTFOLIO_REPLAY_TICKS", os.path.join(os.path.dirname(os.path.abspath(__file__)), "replay_ticks.csv"))
+
+try:
+    import websocket  # websocket-client, optional
+except ImportError:
+    websocket = None
+
+# --- Price Bus ---
+class PriceBus:
+    """Thread-safe, versioned store of the latest tick per ticker"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ticks: Dict[str, Dict] = {}
+        self._versions: Dict[str, int] = {}
+        self._watched: Dict[str, float] = {}
+        self.version = 0
+
+    def publish(self, ticks: Iterable[Dict]) -> int:
+        """Store ticks whose price changed and return how many did"""
+        changed = 0
+        with self._lock:
+            for tick in ticks:
+                ticker = tick["ticker"]
+                previous = self._ticks.get(ticker)
+                if previous is not None and previous["price"] == tick["price"]:
+                    continue
+                self.version += 1
+                self._ticks[ticker] = tick
+                self._versions[ticker] = self.version
+                changed += 1
+        return changed
+
+    def changes_since(self, version: int, tickers: Optional[Iterable[str]] = None) -> Tuple[int, Dict[str, Dict]]:
+        """Return the current version and ticks updated after ``version``"""
+        with self._lock:
+            wanted = set(tickers) if tickers is not None else self._ticks.keys()
+            changed = {
+                ticker: self._ticks[ticker]
+                for ticker in wanted
+                if self._versions.get(ticker, 0) > version
+            }
+            return self.version, changed
+
+    def latest(self, tickers: Iterable[str]) -> Dict[str, Dict]:
+        """Return the last known tick for each requested ticker"""
+        with self._lock:
+            return {ticker: self._ticks[ticker] for ticker in tickers if ticker in self._ticks}
+
+    def watch(self, tickers: Iterable[str]):
+        """Register tickers an open session wants streamed"""
+        now = time.time()
+        with self._lock:
+            for ticker in tickers:
+                self._watched[ticker] = now
+
+    def watched(self) -> List[str]:
+        """Return tickers requested by any session recently"""
+        cutoff = time.time() - WATCH_EXPIRY
+        with self._lock:
+            for ticker in [t for t, seen in self._watched.items() if seen < cutoff]:
+                del self._watched[ticker]
+            return sorted(self._watched)
+
+# --- Price Sources ---
+class PriceSource:
+    """Background thread that pushes ticks into a bus"""
+    name = "source"
+
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.bus: Optional[PriceBus] = None
+
+    def start(self, bus: PriceBus):
+        self.bus = bus
+        self._thread = threading.Thread(target=self._run_safely, name=f"price-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run_safely(self):
+        while not self._stop.is_set():
+            try:
+                self.run()
+            except Exception as e:
+                logger.error(f"Price source '{self.name}' failed: {str(e)}")
+                self._stop.wait(POLL_INTERVAL)
+
+    def run(self):
+        raise NotImplementedError
+
+class BatchedPoller(PriceSource):
+    """Poll every watched ticker in a single batched request"""
+    name = "poller"
+
+    def __init__(self, interval: float = POLL_INTERVAL):
+        super().__init__()
+        self.interval = interval
+
+    def run(self):
+        while not self._stop.is_set():
+            tickers = self.bus.watched()
+            if tickers:
+                self.bus.publish(self.fetch(tickers))
+            self._stop.wait(self.interval)
+
+    @staticmethod
+    def fetch(tickers: List[str]) -> List[Dict]:
+        """Fetch the latest intraday close for all tickers at once"""
+        frame = yf.download(
+            tickers, period="1d", interval="1m",
+            group_by="column", progress=False, threads=False, auto_adjust=False
+        )
+        if frame is None or frame.empty:
+            return []
+
+        closes = frame["Close"]
+        if isinstance(closes, pd.Series):
+            closes = closes.to_frame(tickers[0])
+
+        ticks = []
+        for ticker in closes.columns:
+            series = closes[ticker].dropna()
+            if series.empty:
+                continue
+            ticks.append({
+                "ticker": str(ticker),
+                "price": float(series.iloc[-1]),
+                "ts": series.index[-1].timestamp()
+            })
+        return ticks
+
+class WebSocketSource(PriceSource):
+    """Subscribe to a JSON websocket feed of {"symbol", "price"} messages"""
+    name = "websocket"
+
+    def __init__(self, url: str):
+        super().__init__()
+        if websocket is None:
+            raise ImportError("websocket-client is required for the websocket price source")
+        self.url = url
+        self._subscribed: List[str] = []
+
+    def run(self):
+        conn = websocket.create_connection(self.url, timeout=POLL_INTERVAL)
+        self._subscribed = []
+        try:
+            while not self._stop.is_set():
+                tickers = self.bus.watched()
+                if tickers != self._subscribed:
+                    conn.send(json.dumps({"subscribe": tickers}))
+                    self._subscribed = tickers
+                try:
+                    message = conn.recv()
+                except websocket.WebSocketTimeoutException:
+                    continue
+                self.bus.publish(self.parse(message))
+        finally:
+            conn.close()
+
+    @staticmethod
+    def parse(message: str) -> List[Dict]:
+        """Turn one feed message (object or list of objects) into ticks"""
+        payload = json.loads(message)
+        items = payload if isinstance(payload, list) else [payload]
+        ticks = []
+        for item in items:
+            symbol = item.get("symbol") or item.get("id")
+            price = item.get("price")
+            if symbol and price is not None:
+                ticks.append({"ticker": symbol, "price": float(price), "ts": item.get("time", time.time())})
+        return ticks
+
+class ReplaySource(PriceSource):
+    """Replay recorded ticks from a CSV file (timestamp,ticker,price) for offline use"""
+    name = "replay"
+
+    def __init__(self, path: str = REPLAY_FILE, speed: float = 1.0, loop: bool = True):
+        super().__init__()
+        self.path = path
+        self.speed = speed
+        self.loop = loop
+
+    def load(self) -> List[Dict]:
+        with open(self.path, newline="") as fh:
+            rows = [
+                {"ticker": row["ticker"].upper(), "price": float(row["price"]), "ts": float(row["timestamp"])}
+                for row in csv.DictReader(fh)
+            ]
+        return sorted(rows, key=lambda row: row["ts"])
+
+    def run(self):
+        ticks = self.load()
+        if not ticks:
+            raise ValueError(f"No ticks found in {self.path}")
+
+        while not self._stop.is_set():
+            previous_ts = ticks[0]["ts"]
+            for tick in ticks:
+                delay = (tick["ts"] - previous_ts) / self.speed
+                if delay > 0 and self._stop.wait(delay):
+                    return
+                previous_ts = tick["ts"]
+                self.bus.publish([{**tick, "ts": time.time()}])
+            if not self.loop:
+                self._stop.wait()
+
+def create_source(mode: str = "auto", **options) -> PriceSource:
+    """Pick a price source: websocket when configured, else batched polling"""
+    if mode == "replay":
+        return ReplaySource(options.get("path", REPLAY_FILE), options.get("speed", 1.0))
+    if mode in ("auto", "websocket") and STREAM_URL and websocket is not None:
+        return WebSocketSource(STREAM_URL)
+    if mode == "websocket":
+        logger.warning("Websocket feed unavailable, falling back to batched polling")
+    return BatchedPoller(options.get("interval", POLL_INTERVAL))
+
+# --- Process-wide Stream ---
+class PriceStream:
+    """Owns one shared bus and upstream subscriber per source mode
+
+    Sessions in Offline Replay read the replay bus while everyone else
+    keeps the live one, so one session can't switch the others' source.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._streams: Dict[Tuple, Tuple[PriceSource, PriceBus]] = {}
+
+    def ensure(self, mode: str = STREAM_MODE, **options) -> PriceBus:
+        """Start the requested source if needed and return its bus"""
+        config = (mode, tuple(sorted(options.items())))
+        with self._lock:
+            if config not in self._streams:
+                bus = PriceBus()
+                source = create_source(mode, **options)
+                source.start(bus)
+                self._streams[config] = (source, bus)
+                logger.info(f"Price stream started with {source.name} source")
+            return self._streams[config][1]
+
+    def source_names(self) -> List[str]:
+        with self._lock:
+            return [source.name for source, _ in self._streams.values()]
+
+# Shared by every session in this server process
+price_stream = PriceStream()